@@ -1,34 +1,121 @@
-import requests
-from bs4 import BeautifulSoup
+import atexit
+import base64
+import csv
+import gc
+import io
+from contextlib import contextmanager
+import functools
 import json
+import math
+import os
+import queue
 import sqlite3
-import plotly.graph_objects as go 
-from flask import Flask, render_template, request
+import sys
+import threading
+import time
+import gzip
+import hashlib
+import importlib.util
+import itertools
+import re
+from urllib.parse import urlsplit
+import zlib
+from flask import (Flask, Response, abort, before_render_template, g, has_request_context,
+    make_response, render_template, request, send_file, template_rendered, url_for)
+
+from forms import (DEFAULT_LIMIT, DOG_FILTERS, DOG_SORT_COLUMNS, SORT_DIRECTIONS, lookup_choice,
+    parse_limit)
+from metrics import Counter, Gauge, Histogram, Registry
+from response_cache import ResponseCache
+
+# requests, bs4 and brotli are only imported by the functions that use
+# them, so serving pages doesn't pay for loading the scraping stack
+PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
 
 app = Flask(__name__)
 
 DOG = 'http://www.animalplanet.com/breed-selector/dog-breeds/all-breeds-a-z.html'
-DB_NAME = 'doginfo.sqlite'
+DB_NAME = 'doginfo.sqlite'      # used until a snapshot has been built
 
-CACHE_FILE_NAME = 'cache.json'
+CATALOG_DIR = 'catalogs'        # snapshots made by build_catalog.py
+CATALOG_POINTER = os.path.join(CATALOG_DIR, 'CURRENT')
+FOLLOW_SNAPSHOTS = True         # switch to new snapshots as they're published
+DB_IMMUTABLE = False            # True while DB_NAME is a published snapshot
+
+CACHE_FILE_NAME = 'cache.json'  # old cache, migrated on first start
+CACHE_DB_NAME = 'cache.sqlite'
 CACHE_DICT = {}
 
-def create_db():
-    '''Creates a SQL database and tables.
+BREED_PAGE_BLOCKS = ['stats clear', 'body divider']  # the only divs parse_breed_page reads
+
+CRAWL_WORKERS = 8           # concurrent breed page fetches
+CRAWL_HOST_INTERVAL = 0.1   # minimum seconds between requests to one host
+CRAWL_RETRIES = 3
+CRAWL_BACKOFF = 0.5         # seconds, doubled after every failed attempt
+CRAWL_TIMEOUT = 10
+
+METRICS = Registry()            # served on /metrics
+REQUEST_SECONDS = METRICS.add(Histogram('dog_request_duration_seconds',
+    'Time from a request coming in to its response starting, by route.', ['route', 'method', 'status']))
+QUERY_SECONDS = METRICS.add(Histogram('dog_query_duration_seconds',
+    'Time spent in each query helper.', ['query']))
+QUERY_ROWS = METRICS.add(Counter('dog_query_rows_total',
+    'Rows returned by each query helper.', ['query']))
+TEMPLATE_SECONDS = METRICS.add(Histogram('dog_template_render_seconds',
+    'Time to render each template.', ['template']))
+PAGE_CACHE_REQUESTS = METRICS.add(Counter('dog_page_cache_requests_total',
+    'Scraped pages read from the page cache (hit), fetched (miss) or kept after a 304 (revalidated).',
+    ['result']))
+PAGE_CACHE_BYTES = METRICS.add(Counter('dog_page_cache_bytes_total',
+    'Bytes of scraped pages read from the page cache (hit), fetched (miss) or kept after a 304 (revalidated).',
+    ['result']))
+PAGE_CACHE_EVICTIONS = METRICS.add(Counter('dog_page_cache_evictions_total',
+    'Scraped pages evicted to keep the page cache under its size cap.'))
+# requests slower than this many milliseconds are logged, if set
+SLOW_REQUEST_MS = float(os.environ['DOG_SLOW_REQUEST_MS']) if os.environ.get('DOG_SLOW_REQUEST_MS') else None
+PLOT_ENDPOINTS = ['doggos', 'group_results']    # routes that plot when the form asks
+
+def timed_query(rows=len):
+    '''Makes a query helper record how long every call takes and how
+    many rows it returns. The time also counts towards the request
+    the query runs for, for the slow request log.
     
     Parameters
     ----------
-    None
+    rows: callable
+        Counts the rows in what the helper returns.
     
     Returns
     -------
-    None
+    callable
+        The decorator.
     '''
-    conn = sqlite3.connect("doginfo.sqlite")
-    cur = conn.cursor()
+    def decorate(function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            QUERY_SECONDS.observe(elapsed, query=function.__name__)
+            QUERY_ROWS.inc(rows(result), query=function.__name__)
+            if has_request_context():
+                g.query_seconds = g.get('query_seconds', 0.0) + elapsed
+                g.queries = g.get('queries', 0) + 1
+            return result
+        return timed
+    return decorate
 
-    drop_dogs = '''
-        DROP TABLE IF EXISTS "Dogs";
+def create_tables(cur):
+    '''Creates the tables and indexes that don't exist yet.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the database to create the tables in.
+    
+    Returns
+    -------
+    None
     '''
     create_dogs = '''
         CREATE TABLE IF NOT EXISTS "Dogs" (
@@ -41,46 +128,221 @@ def create_db():
             "Size" TEXT,
             "Barkiness" TEXT,
             "MinLifespan" INTEGER,
-            "MaxLifespan" INTEGER
+            "MaxLifespan" INTEGER,
+            "Url" TEXT
         );
     '''
-
-    drop_countries = '''
-        DROP TABLE IF EXISTS "Countries";
-    '''
     create_countries = '''
         CREATE TABLE IF NOT EXISTS "Countries" (
             "Id"    INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
             "Country" TEXT NOT NULL
         );
     '''
-
-    drop_groups = '''
-        DROP TABLE IF EXISTS "Groups";
-    '''
     create_groups = '''
         CREATE TABLE IF NOT EXISTS "Groups" (
             "Id"    INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
             "BreedGroup" TEXT NOT NULL
         );
     '''
-
-    cur.execute(drop_countries)
-    cur.execute(drop_groups)
-    cur.execute(drop_dogs)
+    create_breed_pages = '''
+        CREATE TABLE IF NOT EXISTS "BreedPages" (
+            "Name" TEXT PRIMARY KEY,
+            "Url"  TEXT NOT NULL,
+            "Hash" TEXT NOT NULL
+        );
+    '''
+    cur.execute('PRAGMA journal_mode = WAL') # readers don't block a refresh
     cur.execute(create_countries)
     cur.execute(create_groups)
     cur.execute(create_dogs)
+    create_catalog_info = '''
+        CREATE TABLE IF NOT EXISTS "CatalogInfo" (
+            "Key"   TEXT PRIMARY KEY,
+            "Value" TEXT
+        );
+    '''
+    create_group_stats = '''
+        CREATE TABLE IF NOT EXISTS "GroupStats" (
+            "Id"      INTEGER PRIMARY KEY,
+            "GroupBy" TEXT NOT NULL,
+            "Value1"  TEXT,
+            "Value2"  TEXT,
+            "Number"  INTEGER,
+            "Rank"    REAL,
+            "MinLifeSpan" REAL,
+            "MaxLifeSpan" REAL
+        );
+    '''
+    create_similar = '''
+        CREATE TABLE IF NOT EXISTS "Similar" (
+            "DogId"     INTEGER NOT NULL,
+            "Position"  INTEGER NOT NULL,
+            "SimilarId" INTEGER NOT NULL,
+            "Distance"  REAL,
+            PRIMARY KEY ("DogId", "Position")
+        ) WITHOUT ROWID;
+    '''
+    cur.execute(create_breed_pages)
+    columns = [row[1] for row in cur.execute('PRAGMA table_info(Dogs)')]
+    if 'Url' not in columns:
+        # database made before the urls were stored with the dogs
+        cur.execute('ALTER TABLE Dogs ADD COLUMN "Url" TEXT')
+        cur.execute('UPDATE Dogs SET Url = (SELECT Url FROM BreedPages WHERE BreedPages.Name = Dogs.Name)')
+    cur.execute(create_catalog_info)
+    cur.execute(create_group_stats)
+    cur.execute(create_similar)
+    create_search_index(cur)
+    create_indexes(cur)
+
+def create_search_index(cur):
+    '''Creates the full text index over dog names and pastimes if it
+    doesn't exist yet, and fills it from the Dogs table. The index
+    reads the text from Dogs instead of keeping a copy, and keeps
+    prefixes of up to three letters for autocomplete.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the database to create the index in.
+    
+    Returns
+    -------
+    None
+    '''
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'DogsSearch'").fetchone():
+        return
+    cur.execute('''
+        CREATE VIRTUAL TABLE "DogsSearch" USING fts5(
+            Name, OriginalPastime, content='Dogs', content_rowid='Id',
+            tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        )
+    ''')
+    rebuild_search_index(cur)
+
+def rebuild_search_index(cur):
+    '''Fills the full text index again from the Dogs table.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the transaction changing the catalog.
+    
+    Returns
+    -------
+    None
+    '''
+    cur.execute("INSERT INTO DogsSearch(DogsSearch) VALUES ('rebuild')")
+
+INDEXES = {
+    'DogsName': 'CREATE UNIQUE INDEX IF NOT EXISTS "DogsName" ON "Dogs" ("Name")',
+    'CountriesCountry': 'CREATE UNIQUE INDEX IF NOT EXISTS "CountriesCountry" ON "Countries" ("Country")',
+    'GroupsBreedGroup': 'CREATE UNIQUE INDEX IF NOT EXISTS "GroupsBreedGroup" ON "Groups" ("BreedGroup")',
+    'GroupStatsGroupBy': 'CREATE INDEX IF NOT EXISTS "GroupStatsGroupBy" ON "GroupStats" ("GroupBy")',
+    # sorting all dogs
+    'DogsRank': 'CREATE INDEX IF NOT EXISTS "DogsRank" ON "Dogs" ("Rank")',
+    'DogsMinLifespan': 'CREATE INDEX IF NOT EXISTS "DogsMinLifespan" ON "Dogs" ("MinLifespan")',
+    'DogsMaxLifespan': 'CREATE INDEX IF NOT EXISTS "DogsMaxLifespan" ON "Dogs" ("MaxLifespan")',
+}
+# one filter column followed by a sort column, so a filtered search reads
+# its rows already sorted. The rank indexes list Id right after Rank so
+# ties come out in Id order, and also cover the grouping query.
+for column in ['CountryId', 'BreedGroupId', 'Size', 'Barkiness']:
+    INDEXES[f'Dogs{column}Rank'] = (f'CREATE INDEX IF NOT EXISTS "Dogs{column}Rank" ON "Dogs" '
+        f'("{column}", "Rank", "Id", "MinLifespan", "MaxLifespan", "Name")')
+    for sort_column in ['MinLifespan', 'MaxLifespan']:
+        INDEXES[f'Dogs{column}{sort_column}'] = (f'CREATE INDEX IF NOT EXISTS "Dogs{column}{sort_column}" '
+            f'ON "Dogs" ("{column}", "{sort_column}")')
+
+# one per sort of /api/groups, so its pages are read in order. The Id
+# the API breaks ties with is the rowid at the end of every index.
+for sort_column in ['Number', 'Rank', 'MinLifeSpan', 'MaxLifeSpan']:
+    INDEXES[f'GroupStats{sort_column}'] = (f'CREATE INDEX IF NOT EXISTS "GroupStats{sort_column}" '
+        f'ON "GroupStats" ("GroupBy", "{sort_column}")')
+
+def create_indexes(cur):
+    '''Creates the indexes that don't exist yet.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the database to create the indexes in.
+    
+    Returns
+    -------
+    None
+    '''
+    for create_index in INDEXES.values():
+        cur.execute(create_index)
+
+def drop_indexes(cur):
+    '''Drops the indexes, so a bulk load doesn't update them row by row.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the database to drop the indexes from.
+    
+    Returns
+    -------
+    None
+    '''
+    for name in INDEXES:
+        cur.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+def bump_catalog_version(cur):
+    '''Moves the catalog to a new version, so caches built from the
+    old data are thrown away. Call it in the transaction that
+    changes the data.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the transaction changing the catalog.
+    
+    Returns
+    -------
+    None
+    '''
+    cur.execute('''
+        INSERT INTO CatalogInfo VALUES ('Version', 1)
+        ON CONFLICT (Key) DO UPDATE SET Value = Value + 1
+    ''')
+    invalidate_catalog_version()
+
+def create_db():
+    '''Creates a SQL database and tables.
+    Existing tables are dropped first.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    None
+    '''
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS "Countries"')
+    cur.execute('DROP TABLE IF EXISTS "Groups"')
+    cur.execute('DROP TABLE IF EXISTS "Dogs"')
+    cur.execute('DROP TABLE IF EXISTS "BreedPages"')
+    cur.execute('DROP TABLE IF EXISTS "GroupStats"')
+    cur.execute('DROP TABLE IF EXISTS "DogsSearch"')
+    cur.execute('DROP TABLE IF EXISTS "Similar"')
+    create_tables(cur)
+    bump_catalog_version(cur)
     conn.commit()
     conn.close()
 
-def get_dogs():
+def get_dogs(url=DOG):
     '''Creates a dictionary of dogs from url
     and their associated url by scraping.
     
     Parameters
     ----------
-    None
+    url: string
+        The A-Z breed list page. Defaults to the Animal Planet page.
     
     Returns
     -------
@@ -88,8 +350,9 @@ def get_dogs():
         the results of the scraping with a dog breed
         as a key and the url as the value
     '''
+    from bs4 import BeautifulSoup
     dogs_dict = {}
-    dogs = make_url_request_using_cache(DOG, CACHE_DICT) # throwing stick
+    dogs = make_url_request_using_cache(url, CACHE_DICT) # throwing stick
     soup = BeautifulSoup(dogs, 'html.parser')
     all_dogs_first = soup.find_all('section', id='tabAtoZ')
     dogs = all_dogs_first[0].find_all('li')
@@ -98,169 +361,167 @@ def get_dogs():
             dogs_dict[dog.text.strip()] = rel_path['href']
     return dogs_dict
 
-def get_dog_info(dictionary):
-    '''Creates a list of records associated with each dog.
+def get_stats(soup):
+    '''Finds the first stat (the AKC rank) in the 'stats clear' block
+    of a parsed breed page.
     
     Parameters
     ----------
-    dictionary: dict
-        The dictionary containing the urls to scrape and crawl.
+    soup: BeautifulSoup
+        The parsed breed page.
     
     Returns
     -------
-    list
-        Records from each dog in list format.
+    string
+        The first stat in lower case.
     '''
-    dog_list = []
-    for k,v in dictionary.items():
-        info_list = []
-        info_list.append(k)
-        url = make_url_request_using_cache(v, CACHE_DICT) # retrieving stick (1)
-        soup = BeautifulSoup(url, 'html.parser')
-        dog_info = soup.find_all('div', class_='stats clear')
-        more_info = dog_info[0].find_all(class_='right')
-        for info in more_info:
-            x = info.text.lower().strip()
-            info_list.append(x)
-            info_list = info_list[:2]
-        dog_list.append(info_list)
-    return dog_list
+    dog_info = soup.find_all('div', class_='stats clear')
+    more_info = dog_info[0].find_all(class_='right')
+    return more_info[0].text.lower().strip()
 
-def get_more_info(dictionary):
-    '''Creates a list of records associated with each dog.
-    Uses a different html tag to find these records, so a 
-    second function needed.
+def get_fast_facts(soup):
+    '''Finds the FAST FACTS of a parsed breed page and cleans them up.
     
     Parameters
     ----------
-    dictionary: dict
-        The dictionary containing the urls to scrape and crawl.
+    soup: BeautifulSoup
+        The parsed breed page.
     
     Returns
     -------
     list
-        Records from each dog in list format.
+        Original pastime, origin, breed group, size, barkiness,
+        min life span and max life span. None if the page has
+        no fast facts.
     '''
-    dog_list = []
-    for v in dictionary.values():
-        url = make_url_request_using_cache(v, CACHE_DICT) # retrieving stick(2)
-        soup = BeautifulSoup(url, 'html.parser')
-        all_dogs_first = soup.find_all('div', class_='body divider')
-        l = []
-        a = []
-        for i in all_dogs_first:
-            j = i.text.strip()
-            fast_facts = j.find('FACTS')
-            just_the_facts = j[fast_facts:]
-            if ':' in just_the_facts:
-                k=just_the_facts.partition(':')[2]
-                l.append(k)
-                for line in l:
-                    m=line.split('\n')
-                    for n in m:
-                        z=n.partition(':')[2].strip()
-                        a.append(z)
-                if a[1] == 'Y':
-                    a.pop(1)
-                a=a[1:]
-                if len(a) > 7:
-                    a = a[:6]
-                if a[2] == 'Working Dog':
-                    a[2] = 'Working' # clean up breed groups
-                if a[1] == 'Herding':
-                    a[1] = 'Hungary' # clean up origins
-                punc = [',', '/', '&']
-                for mark in punc:
-                    if mark in a[1]:
-                        country = a[1].split(mark)
-                        a[1] = country[0].strip() # clean up origins
-                if a[1] == 'Border of Scotland and England':
-                    a[1] = 'Scotland'
-                years = a.pop(3)
-                years = years.strip(' years')
-                min_max = years.split('-')
-                a.extend(min_max)
-                dog_list.append(a)
-    return dog_list
+    all_dogs_first = soup.find_all('div', class_='body divider')
+    l = []
+    a = []
+    for i in all_dogs_first:
+        j = i.text.strip()
+        fast_facts = j.find('FACTS')
+        just_the_facts = j[fast_facts:]
+        if ':' in just_the_facts:
+            k=just_the_facts.partition(':')[2]
+            l.append(k)
+            for line in l:
+                m=line.split('\n')
+                for n in m:
+                    z=n.partition(':')[2].strip()
+                    a.append(z)
+            if a[1] == 'Y':
+                a.pop(1)
+            a=a[1:]
+            if len(a) > 7:
+                a = a[:6]
+            if a[2] == 'Working Dog':
+                a[2] = 'Working' # clean up breed groups
+            if a[1] == 'Herding':
+                a[1] = 'Hungary' # clean up origins
+            punc = [',', '/', '&']
+            for mark in punc:
+                if mark in a[1]:
+                    country = a[1].split(mark)
+                    a[1] = country[0].strip() # clean up origins
+            if a[1] == 'Border of Scotland and England':
+                a[1] = 'Scotland'
+            years = a.pop(3)
+            years = years.strip(' years')
+            min_max = years.split('-')
+            a.extend(min_max)
+            return a
+    return None
 
-def combine_dog_lists(list_1, list_2):
-    '''Combines two lists of dog inforamtion.
+def parse_breed_page(name, html, url=None):
+    '''Parses a breed page once and builds the complete record
+    for the breed. Only the 'stats clear' and 'body divider'
+    blocks are parsed, the rest of the page is skipped.
     
     Parameters
     ----------
-    list_1: list
-        List of dog information.
+    name: string
+        The name of the breed.
+    html: string
+        The breed page.
+    url: string
+        The URL of the breed page.
+    
+    Returns
+    -------
+    list
+        Name, rank, original pastime, origin, breed group, size,
+        barkiness, min life span, max life span and url. None if
+        the page is missing one of the blocks.
+    '''
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(html, PARSER, parse_only=SoupStrainer('div', class_=BREED_PAGE_BLOCKS))
+    try:
+        facts = get_fast_facts(soup)
+        if facts is None:
+            return None
+        return [name, get_stats(soup)] + facts + [url]
+    except IndexError:
+        return None
+
+def get_breed_records(dictionary):
+    '''Creates a list of records associated with each dog.
+    Breeds whose page can't be fetched or parsed are skipped.
     
-    list_2: list
-        List of dog information.
+    Parameters
+    ----------
+    dictionary: dict
+        The dictionary containing the urls to scrape and crawl.
     
     Returns
     -------
     list
         Records from each dog in list format.
     '''
-    list_of_dog_lists = []
-    for i, dog in enumerate(list_1):
-        doggy = list_2[i]
-        total_dog_list = dog + doggy
-        list_of_dog_lists.append(total_dog_list)
-    return list_of_dog_lists
+    import requests
+    dog_list = []
+    for k,v in dictionary.items():
+        try:
+            html = make_url_request_using_cache(v, CACHE_DICT) # retrieving stick
+        except requests.RequestException as e:
+            print(f"Lost the stick for {k}: {e}")
+            continue
+        record = parse_breed_page(k, html, v)
+        if record is None:
+            print(f"No treats on the page for {k}")
+            continue
+        dog_list.append(record)
+    return dog_list
 
-def add_info(list_of_info):
+def add_info(cur, list_of_info, countries, groups):
     '''Adds records to the dogs table in the SQL database.
+    Foreign keys are looked up in the country and breed group
+    dictionaries instead of the database.
     
     Parameters
     ----------
+    cur: sqlite3.Cursor
+        Cursor of an open transaction.
     list_of_info: list
         A list containing all the information for each dog.
+    countries: dictionary
+        Country-Id in a key-value pair.
+    groups: dictionary
+        Breed group-Id in a key-value pair.
     
     Returns
     -------
     None
     '''
-    select_country_id_sql = '''
-        SELECT Id FROM Countries
-        WHERE Country = ?
-    '''
-
-    select_group_id_sql = '''
-        SELECT Id FROM Groups
-        WHERE BreedGroup = ?
-    '''
-
-    insert_dogs = f'''
-    INSERT INTO Dogs
-    VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    insert_dogs = '''
+    INSERT INTO Dogs (Name, Rank, OriginalPastime, CountryId, BreedGroupId,
+        Size, Barkiness, MinLifespan, MaxLifespan, Url)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    for dog in list_of_info:
-        cur.execute(select_country_id_sql, [dog[3]])
-        res = cur.fetchone()
-        country_id = None
-        if res is not None:
-            country_id = res[0]
-
-        cur.execute(select_group_id_sql, [dog[4]])
-        grp = cur.fetchone()
-        group_id = None
-        if grp is not None:
-            group_id = grp[0]
-
-        cur.execute(insert_dogs, [
-            dog[0],
-            dog[1],
-            dog[2],
-            country_id,
-            group_id,
-            dog[5],
-            dog[6],
-            dog[7],
-            dog[8]
-        ])
-    conn.commit()
-    conn.close()
-
+    cur.executemany(insert_dogs, (
+        (dog[0], dog[1], dog[2], countries.get(dog[3]), groups.get(dog[4]),
+            dog[5], dog[6], dog[7], dog[8], dog[9])
+        for dog in list_of_info
+    ))
 
 def populate_countries(list_of_info):
     '''Creates a dictionary with a country as the key
@@ -287,11 +548,13 @@ def populate_countries(list_of_info):
             country = countries[country]
     return countries
                 
-def country_table(dictionary):
+def country_table(cur, dictionary):
     '''Adds records to the countries table in the SQL database.
     
     Parameters
     ----------
+    cur: sqlite3.Cursor
+        Cursor of an open transaction.
     dictionary: dictionary
        A dictionary of the country and id as key-value pairs.
     
@@ -301,19 +564,9 @@ def country_table(dictionary):
     '''
     insert_countries = '''
     INSERT INTO Countries
-    VALUES (NULL, ?)
+    VALUES (?, ?)
     '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    countries = []
-    for k in dictionary.keys():
-        countries.append(k)
-    for country in countries:
-        y = []
-        y.append(country)
-        cur.execute(insert_countries, y)
-        conn.commit()
-    conn.close()
+    cur.executemany(insert_countries, ((v, k) for k, v in dictionary.items()))
 
 def populate_breed_groups(list_of_info):
     '''Creates a dictionary with a breed group as the key
@@ -344,11 +597,13 @@ def populate_breed_groups(list_of_info):
             group = groups[group]
     return groups
 
-def group_table(dictionary):
+def group_table(cur, dictionary):
     '''Adds records to the groups table in the SQL database.
     
     Parameters
     ----------
+    cur: sqlite3.Cursor
+        Cursor of an open transaction.
     dictionary: dictionary
        A dictionary of the breed group and id as key-value pairs.
     
@@ -358,287 +613,1902 @@ def group_table(dictionary):
     '''
     insert_groups = '''
     INSERT INTO Groups
-    VALUES (NULL, ?)
+    VALUES (?, ?)
     '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    groups = []
-    for k in dictionary.keys():
-        groups.append(k)
-    for group in groups:
-        y = []
-        y.append(group)
-        cur.execute(insert_groups, y)
-        conn.commit()
-    conn.close()
+    cur.executemany(insert_groups, ((v, k) for k, v in dictionary.items()))
 
-def load_cache(): 
-    ''' Opens the cache file if it exists and loads the JSON into
-    the CACHE_DICT dictionary.
-    if the cache file doesn't exist, creates a new cache dictionary
+def load_catalog(list_of_info):
+    '''Loads dogs, countries and breed groups into the empty tables
+    made by create_db in a single transaction. The indexes are
+    built once after the rows are in, and the load skips syncing
+    to disk until it commits.
     
     Parameters
     ----------
-    None
+    list_of_info: list
+        A list containing all the information for each dog.
     
     Returns
     -------
-    The opened cache: dict
+    None
     '''
+    countries = populate_countries(list_of_info)
+    groups = populate_breed_groups(list_of_info)
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    cur = conn.cursor()
+    cur.execute('PRAGMA synchronous = OFF')
+    cur.execute('PRAGMA temp_store = MEMORY')
+    cur.execute('PRAGMA cache_size = -65536') # 64 MB
+    cur.execute('BEGIN')
     try:
-        cache_file = open(CACHE_FILE_NAME, 'r')
-        cache_file_contents = cache_file.read()
-        cache = json.loads(cache_file_contents)
-        cache_file.close()
+        drop_indexes(cur)
+        country_table(cur, countries)
+        group_table(cur, groups)
+        add_info(cur, list_of_info, countries, groups)
+        create_indexes(cur)
+        rebuild_search_index(cur)
+        build_group_stats(cur)
+        build_similar(cur)
+        bump_catalog_version(cur)
+        cur.execute('ANALYZE')
+        cur.execute('COMMIT')
     except:
-        cache = {}
-    return cache
+        cur.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
 
-
-def save_cache(cache):
-    ''' Saves the current state of the cache to disk
+def record_page_hashes(dictionary, cache):
+    '''Saves the content hash of every breed page, so the next
+    refresh can tell which pages changed.
     
     Parameters
     ----------
-    cache_dict: dict
-        The dictionary to save
+    dictionary: dict
+        Breed name as the key and the url as the value.
+    cache: PageCache
+        The page cache holding the breed pages.
     
     Returns
     -------
     None
     '''
-    cache_file = open(CACHE_FILE_NAME, 'w')
-    contents_to_write = json.dumps(cache)
-    cache_file.write(contents_to_write)
-    cache_file.close()
-
+    hashes = cache.hashes(dictionary.values())
+    rows = [(k, v, hashes[v]) for k, v in dictionary.items() if v in hashes]
+    conn = sqlite3.connect(DB_NAME)
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO BreedPages VALUES (?, ?, ?)', rows)
+    conn.close()
 
-def make_url_request_using_cache(url, cache):
-    '''Check the cache for a saved result for the unique key for a url scrape. 
-    If the result is found, return it. Otherwise send a new 
-    request, save it, then return it.
+def upsert_dogs(cur, list_of_info):
+    '''Inserts or updates dogs by name, adding any country
+    or breed group that isn't in the lookup tables yet.
     
     Parameters
     ----------
-    url: string
-        The URL for the scrape.
-    cache:
-        The json file used to save searches.
+    cur: sqlite3.Cursor
+        Cursor of an open transaction.
+    list_of_info: list
+        Records of the dogs to insert or update.
     
     Returns
     -------
-    dict
-        the results of the query as a dictionary loaded from cache
-        JSON
+    None
     '''
-    if (url in cache.keys()): 
-        print("Retrieving stick")
-        return cache[url]    
-    else:
-        print("Throwing stick")
-        response = requests.get(url) 
-        cache[url] = response.text
-        save_cache(cache)          
-        return cache[url] 
+    cur.executemany('INSERT OR IGNORE INTO Countries VALUES (NULL, ?)',
+        [[dog[3]] for dog in list_of_info])
+    cur.executemany('INSERT OR IGNORE INTO Groups VALUES (NULL, ?)',
+        [[dog[4]] for dog in list_of_info])
+    upsert_dogs_sql = '''
+        INSERT INTO Dogs (Name, Rank, OriginalPastime, CountryId, BreedGroupId,
+            Size, Barkiness, MinLifespan, MaxLifespan, Url)
+        VALUES (?, ?, ?,
+            (SELECT Id FROM Countries WHERE Country = ?),
+            (SELECT Id FROM Groups WHERE BreedGroup = ?),
+            ?, ?, ?, ?, ?)
+        ON CONFLICT (Name) DO UPDATE SET
+            Rank=excluded.Rank, OriginalPastime=excluded.OriginalPastime,
+            CountryId=excluded.CountryId, BreedGroupId=excluded.BreedGroupId,
+            Size=excluded.Size, Barkiness=excluded.Barkiness,
+            MinLifespan=excluded.MinLifespan, MaxLifespan=excluded.MaxLifespan,
+            Url=excluded.Url
+    '''
+    cur.executemany(upsert_dogs_sql, list_of_info)
 
-def get_group_results_sql(group_by, sort_order, sort_by):
-    '''Constructs a SQL query when the user searches by grouping.
+def refresh_catalog(dictionary, cache):
+    '''Brings the database up to date with the breed pages without
+    rebuilding it. Pages that aren't cached or are stale are fetched
+    first, the stale ones with conditional requests. Only pages whose
+    content hash changed since the last refresh are parsed, and only
+    their dogs are written. Breeds that are no longer listed are
+    removed.
     
     Parameters
     ----------
-    group_by: string
-        String representation of html form. What the user
-        wants to group by.
-    sort_order: string
-        String representation of html form. How the user
-        wants to sort data.
-    sort_by: string
-        String representation of html form. Sort by
-        numerical data.
-
+    dictionary: dict
+        Breed name as the key and the url as the value.
+    cache: PageCache
+        The page cache holding the breed pages.
+    
     Returns
     -------
     tuple
-        the results of the query as a nested tuple.
+        Number of changed breeds and number of removed breeds.
     '''
+    import requests
     conn = sqlite3.connect(DB_NAME)
     cur = conn.cursor()
-    limit = 'LIMIT 10'
-    if group_by == 'breed group':
-        join_and_group = 'JOIN Groups AS G ON D.BreedGroupId=G.Id GROUP BY G.BreedGroup'
-        select = 'G.BreedGroup'
-    elif group_by == 'origin':
-        join_and_group = 'JOIN Countries AS C ON D.CountryId=C.Id GROUP BY C.Country'
-        select = 'C.Country'
-    elif group_by == 'size':
-        select = 'D.Size'
-        join_and_group = 'GROUP BY Size'
-    elif group_by == 'barkiness':
-        select = 'D.Barkiness'
-        join_and_group = 'GROUP BY Barkiness'
-    if sort_by == 'rank':
-        sort_by = 'Rank'
-    elif sort_by == 'max_life':
-        sort_by = 'MaxLifeSpan'
-    elif sort_by == 'min_life':
-        sort_by = 'MinLifeSpan'
-    elif sort_by == 'number':
-        sort_by = 'Number'
-    query = f'''
-    SELECT {select},  COUNT(DISTINCT Name) AS Number, ROUND(AVG(Rank), 2) AS Rank, ROUND(AVG(MinLifeSpan), 2) AS MinLifeSpan, 
-    ROUND(AVG(MaxLifeSpan), 2) AS MaxLifeSpan FROM Dogs AS D
-    {join_and_group} HAVING {sort_by} <> 'n/a' ORDER BY {sort_by} {sort_order} {limit}
+    create_tables(cur)
+    conn.commit()
+    stored = dict(cur.execute('SELECT Name, Hash FROM BreedPages').fetchall())
+    due = cache.due(dictionary.values())
+    for k, v in dictionary.items():
+        if v in due:
+            try:
+                make_url_request_using_cache(v, cache) # throwing stick
+            except requests.RequestException as e:
+                print(f"Lost the stick for {k}: {e}")
+    hashes = cache.hashes(dictionary.values())
+    # a breed whose page can't be had at all keeps its stored row
+    changed = {k: v for k, v in dictionary.items()
+        if v in hashes and stored.get(k) != hashes[v]}
+    removed = [[k] for k in stored if k not in dictionary]
+    if not changed and not removed:
+        conn.close()
+        return 0, 0
+
+    records = []
+    for k, v in changed.items():
+        record = parse_breed_page(k, cache.get(v), v)
+        if record is None:
+            print(f"No treats on the page for {k}")
+            removed.append([k])
+            continue
+        records.append(record)
+    # the search index keeps no copy of the text, so old rows are taken
+    # out of it with their old text before Dogs changes
+    unindex = '''
+    INSERT INTO DogsSearch(DogsSearch, rowid, Name, OriginalPastime)
+    SELECT 'delete', Id, Name, OriginalPastime FROM Dogs WHERE Name = ?
+    '''
+    index = '''
+    INSERT INTO DogsSearch(rowid, Name, OriginalPastime)
+    SELECT Id, Name, OriginalPastime FROM Dogs WHERE Name = ?
     '''
-    results = cur.execute(query).fetchall()
+    with conn:
+        removed_ids = [row[0] for k in removed
+            for row in cur.execute('SELECT Id FROM Dogs WHERE Name = ?', k)]
+        touched = [k[0] for k in removed] + [record[0] for record in records]
+        values = group_values(cur, touched)
+        cur.executemany(unindex, removed + [[record[0]] for record in records])
+        upsert_dogs(cur, records)
+        changed_ids = [row[0] for record in records
+            for row in cur.execute('SELECT Id FROM Dogs WHERE Name = ?', [record[0]])]
+        cur.executemany(index, [[record[0]] for record in records])
+        cur.executemany('DELETE FROM Dogs WHERE Name = ?', removed)
+        cur.executemany('DELETE FROM BreedPages WHERE Name = ?',
+            [k for k in removed if k[0] not in changed])
+        cur.executemany('INSERT OR REPLACE INTO BreedPages VALUES (?, ?, ?)',
+            [(k, v, hashes[v]) for k, v in changed.items()])
+        cur.execute('DELETE FROM Countries WHERE Id NOT IN (SELECT CountryId FROM Dogs)')
+        cur.execute('DELETE FROM Groups WHERE Id NOT IN (SELECT BreedGroupId FROM Dogs)')
+        update_group_stats(cur, values | group_values(cur, touched))
+        update_similar(cur, changed_ids, removed_ids)
+        bump_catalog_version(cur)
+    cur.execute('PRAGMA optimize')
     conn.close()
-    return results
+    return len(changed), len(removed)
 
-def get_dog_results_sql(sort_by, sort_order, region, size, breed_group, bark, limit):
-    '''Constructs a SQL query when the user searches by dog.
+PAGE_CACHE_TTL = float(os.environ.get('DOG_PAGE_CACHE_TTL', 7 * 24 * 60 * 60)) # seconds a page is fresh
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('DOG_PAGE_CACHE_BYTES', 512 * 1024 * 1024)) # compressed
+PAGE_CACHE_EVICT_TO = 0.9       # eviction stops at this share of PAGE_CACHE_MAX_BYTES
+
+def conditional_headers(etag, last_modified):
+    '''Builds the headers that ask a server to only send a page if it
+    changed since it was cached.
     
     Parameters
     ----------
-    sort_by: string
-        String representation of html form. Sort by
-        numerical data.
-    sort_order: string
-        String representation of html form. How the user
-        wants to sort data.
-    region: string
-        String representation of html form. Filter by
-        region of origion.
-    size: string
-        String representation of html form. Filter by dog size.
-    breed_group: string
-        String representation of html form. Filter by breed group.
-    bark: string
-        String representation of html form. Filter by noise level.
-    limit: int
-        Integer representing number of rows that the user requests.
-
+    etag: string
+        ETag the page was served with, or None.
+    last_modified: string
+        Last-Modified the page was served with, or None.
+    
     Returns
     -------
-    tuple
-        the results of the query as a nested tuple.
-    '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    if sort_by == 'rank':
-        sort_by = 'Rank'
-    elif sort_by == 'max_life':
-        sort_by = 'MaxLifeSpan'
-    elif sort_by == 'min_life':
-        sort_by = 'MinLifeSpan'
-    if region == 'All':
-        region = ''
-        if size == 'All':
-            size = ''
-            if breed_group == 'All':
-                breed_group = ''
-                if bark == 'All bark levels':
-                    bark = ''
-                else:
-                    bark = f"WHERE Barkiness='{bark}'"
-            else:
-                breed_group = f"WHERE BreedGroup='{breed_group}'"
-                if bark == 'All bark levels':
-                    bark = ''
-                else:
-                    bark = f"AND Barkiness='{bark}'"
-        else:
-            size = f"WHERE Size='{size}'"
-            if breed_group == 'All':
-                breed_group = ''
-            else:
-                breed_group = f"AND BreedGroup='{breed_group}'"
-            if bark == 'All bark levels':
-                bark = ''
-            else:
-                bark = f"AND Barkiness='{bark}'"
-    else:
-        region = f"WHERE Country='{region}'"
-        if size == 'All':
-            size = ''
-        else:
-            size = f"AND Size='{size}'"
-        if breed_group == 'All':
-            breed_group = ''
-        else:
-            breed_group = f" AND BreedGroup='{breed_group}'"
-        if bark == 'All bark levels':
-            bark = ''
-        else:
-            bark = f" AND Barkiness='{bark}'"
-    if limit:
-        limit = limit
-    else:
-        limit = 10
-    query = f'''
-    SELECT Name, Rank, C.Country, G.BreedGroup, Size, Barkiness, MinLifeSpan, MaxLifeSpan FROM DOGS AS D
-    JOIN Countries AS C ON D.CountryId=C.Id JOIN Groups as G on D.BreedGroupId=G.Id
-    {region} {size} {breed_group} {bark} ORDER BY {sort_by} {sort_order} LIMIT {limit}
+    dict
+        The request headers, empty without validators.
     '''
-    results = cur.execute(query).fetchall()
-    conn.close()
-    return results
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
 
-def get_barkiness():
-    '''Uses SQL database to find all unique instances
-    in a column.
+def response_validators(response):
+    '''Reads the validators of a response, for revalidating the page
+    once it's stale.
     
     Parameters
     ----------
-    None
-
+    response: requests.Response
+        The response.
+    
     Returns
     -------
-    list
-        list of all bark levels.
+    tuple
+        The ETag and the Last-Modified header, None where missing.
     '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    query = '''
-    SELECT DISTINCT(Barkiness) FROM Dogs
+    return response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+class PageCache:
+    '''Page cache stored in a SQLite file. Every page is one row with a
+    zlib compressed body, so a cache miss writes a single row and a
+    lookup only reads the page it needs. Pages older than the TTL are
+    stale and revalidated with the ETag and Last-Modified headers they
+    were served with. The least recently used pages are evicted when
+    the cache grows past max_bytes.
     '''
-    results = cur.execute(query).fetchall()
-    conn.close()
-    bark_list = []
-    for item in results:
-        for x in item:
-            bark_list.append(x)
-    bark_list.sort()
-    return bark_list
+    def __init__(self, path, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_BYTES):
+        '''
+        Parameters
+        ----------
+        path: string
+            Path of the SQLite file.
+        ttl: float
+            Seconds a page is fresh after it was fetched or revalidated.
+        max_bytes: int
+            Size cap for the compressed pages.
+        '''
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL') # every read updates UsedAt
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS "Pages" (
+                "Url"  TEXT PRIMARY KEY,
+                "Body" BLOB NOT NULL,
+                "FetchedAt" REAL NOT NULL,
+                "Hash" TEXT,
+                "ETag" TEXT,
+                "LastModified" TEXT,
+                "UsedAt" REAL,
+                "Size" INTEGER
+            )
+        ''')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(Pages)')]
+        for column, kind in [('Hash', 'TEXT'), ('ETag', 'TEXT'), ('LastModified', 'TEXT'),
+                ('UsedAt', 'REAL'), ('Size', 'INTEGER')]:
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE Pages ADD COLUMN "{column}" {kind}')
+        self.conn.execute('''
+            UPDATE Pages SET UsedAt = COALESCE(UsedAt, FetchedAt), Size = COALESCE(Size, length(Body))
+            WHERE UsedAt IS NULL OR Size IS NULL
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS "PagesUsedAt" ON "Pages" ("UsedAt")')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(Size), 0) FROM Pages').fetchone()[0]
 
-def get_sizes():
-    '''Uses SQL database to find all unique instances
-    in a column.
+    def __contains__(self, url):
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM Pages WHERE Url = ?', [url]).fetchone()
+        return row is not None
+
+    def __getitem__(self, url):
+        page = self.get(url)
+        if page is None:
+            raise KeyError(url)
+        return page
+
+    def __setitem__(self, url, page):
+        self.put_many([(url, page)])
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM Pages').fetchone()[0]
+
+    def keys(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute('SELECT Url FROM Pages')]
+
+    def get(self, url, default=None):
+        '''Returns the page for a url, fresh or not, or default if it
+        isn't cached.
+        
+        Parameters
+        ----------
+        url: string
+            The URL of the page.
+        default:
+            Returned when the page isn't cached.
+        
+        Returns
+        -------
+        string
+            The page.
+        '''
+        page, validators = self.lookup(url)
+        return default if page is None else page
+
+    def lookup(self, url):
+        '''Returns the page for a url and, if it is stale, the headers
+        that revalidate it. Marks the page as used.
+        
+        Parameters
+        ----------
+        url: string
+            The URL of the page.
+        
+        Returns
+        -------
+        tuple
+            The page, or None if it isn't cached, and None if the page
+            is fresh or else a dict of conditional request headers. The
+            dict is empty if the page came without validators.
+        '''
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT Body, FetchedAt, ETag, LastModified FROM Pages WHERE Url = ?',
+                [url]).fetchone()
+            if row is None:
+                return None, None
+            with self.conn:
+                self.conn.execute('UPDATE Pages SET UsedAt = ? WHERE Url = ?', [now, url])
+        page = zlib.decompress(row[0]).decode('utf-8')
+        if now - row[1] < self.ttl:
+            return page, None
+        return page, conditional_headers(row[2], row[3])
+
+    def due(self, urls):
+        '''Finds the urls that have to be fetched: the ones that aren't
+        cached and the ones that are stale.
+        
+        Parameters
+        ----------
+        urls: iterable
+            The URLs to check.
+        
+        Returns
+        -------
+        dict
+            URL as the key and the conditional request headers as the
+            value, which are empty for pages that aren't cached.
+        '''
+        urls = list(dict.fromkeys(urls))
+        cached = {}
+        with self.lock:
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                marks = ', '.join('?' * len(chunk))
+                query = f'SELECT Url, FetchedAt, ETag, LastModified FROM Pages WHERE Url IN ({marks})'
+                for url, fetched_at, etag, last_modified in self.conn.execute(query, chunk):
+                    cached[url] = (fetched_at, etag, last_modified)
+        now = time.time()
+        due = {}
+        for url in urls:
+            if url not in cached:
+                due[url] = {}
+            elif now - cached[url][0] >= self.ttl:
+                due[url] = conditional_headers(*cached[url][1:])
+        return due
+
+    def put_many(self, pages):
+        '''Compresses and stores pages in a single transaction, then
+        evicts the least recently used pages if the cache is too big.
+        
+        Parameters
+        ----------
+        pages: iterable
+            (url, page) pairs, or (url, page, etag, last_modified)
+            tuples with the validators the page was served with.
+        
+        Returns
+        -------
+        None
+        '''
+        now = time.time()
+        rows = []
+        for url, page, *validators in pages:
+            etag, last_modified = validators or (None, None)
+            body = page.encode('utf-8')
+            compressed = zlib.compress(body)
+            rows.append((url, compressed, now, hashlib.sha1(body).hexdigest(), etag, last_modified,
+                now, len(compressed)))
+        with self.lock:
+            with self.conn:
+                self.conn.executemany('''
+                    INSERT OR REPLACE INTO Pages (Url, Body, FetchedAt, Hash, ETag, LastModified, UsedAt, Size)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+            self.size += sum(row[-1] for row in rows)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def revalidated(self, url, etag=None, last_modified=None):
+        '''Marks a stale page as fresh again after the server answered
+        304 Not Modified.
+        
+        Parameters
+        ----------
+        url: string
+            The URL of the page.
+        etag: string
+            ETag of the 304 response, if it sent a new one.
+        last_modified: string
+            Last-Modified of the 304 response, if it sent one.
+        
+        Returns
+        -------
+        None
+        '''
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute('''
+                    UPDATE Pages SET FetchedAt = ?, UsedAt = ?, ETag = COALESCE(?, ETag),
+                    LastModified = COALESCE(?, LastModified) WHERE Url = ?
+                ''', [now, now, etag, last_modified, url])
+
+    def evict(self):
+        '''Deletes the least recently used pages until the cache is
+        down to PAGE_CACHE_EVICT_TO of max_bytes. Call with the lock
+        held.
+        
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        int
+            Number of pages evicted.
+        '''
+        # the running size only counts up, so start from the real one
+        self.size = self.conn.execute('SELECT COALESCE(SUM(Size), 0) FROM Pages').fetchone()[0]
+        target = self.max_bytes * PAGE_CACHE_EVICT_TO
+        if self.size <= self.max_bytes:
+            return 0
+        evicted = []
+        rows = self.conn.execute('SELECT Url, Size FROM Pages ORDER BY UsedAt')
+        for url, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((url,))
+            self.size -= size
+        rows.close()
+        with self.conn:
+            self.conn.executemany('DELETE FROM Pages WHERE Url = ?', evicted)
+        PAGE_CACHE_EVICTIONS.inc(len(evicted))
+        return len(evicted)
+
+    def hashes(self, urls):
+        '''Returns the content hash of every cached page in urls
+        without decompressing the pages.
+        
+        Parameters
+        ----------
+        urls: iterable
+            The URLs to look up.
+        
+        Returns
+        -------
+        dict
+            URL as the key and the SHA-1 of the page as the value.
+            URLs that aren't cached are left out.
+        '''
+        urls = list(urls)
+        found = {}
+        with self.lock:
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                marks = ', '.join('?' * len(chunk))
+                query = f'SELECT Url, Hash FROM Pages WHERE Url IN ({marks})'
+                found.update(self.conn.execute(query, chunk).fetchall())
+        for url, page_hash in found.items():
+            if page_hash is None:
+                # stored before hashes were kept
+                found[url] = hashlib.sha1(self.get(url).encode('utf-8')).hexdigest()
+                with self.lock:
+                    with self.conn:
+                        self.conn.execute('UPDATE Pages SET Hash = ? WHERE Url = ?', [found[url], url])
+        return found
+
+    def close(self):
+        self.conn.close()
+
+def migrate_json_cache(cache, json_file=CACHE_FILE_NAME):
+    '''Moves the pages of the old JSON cache file into the page cache
+    and renames the JSON file so the migration only runs once.
     
     Parameters
     ----------
-    None
-
+    cache: PageCache
+        The page cache to fill.
+    json_file: string
+        Path of the old JSON cache.
+    
     Returns
     -------
-    list
-        list of all dog sizes.
+    int
+        Number of pages migrated.
+    '''
+    if not os.path.exists(json_file):
+        return 0
+    with open(json_file, 'r') as cache_file:
+        old_cache = json.load(cache_file)
+    cache.put_many(old_cache.items())
+    os.replace(json_file, json_file + '.migrated')
+    return len(old_cache)
+
+def load_cache(): 
+    ''' Opens the page cache, creating it if it doesn't exist.
+    Pages from an old cache.json are moved into it the first time.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    The opened cache: PageCache
+    '''
+    cache = PageCache(CACHE_DB_NAME)
+    migrated = migrate_json_cache(cache)
+    if migrated:
+        print(f"Moved {migrated} sticks from {CACHE_FILE_NAME} to {CACHE_DB_NAME}")
+    return cache
+
+
+def make_url_request_using_cache(url, cache):
+    '''Check the cache for a saved result for the unique key for a url scrape. 
+    If the result is found and fresh, return it. A stale result is
+    revalidated with a conditional request, so an unchanged page costs
+    a 304 instead of the whole page, and is kept if the site can't be
+    reached. Otherwise send a new request, save it, then return it.
+    
+    Parameters
+    ----------
+    url: string
+        The URL for the scrape.
+    cache: PageCache
+        The page cache used to save searches. A dict of pages also
+        works, and its pages never go stale.
+    
+    Returns
+    -------
+    string
+        the page, loaded from the cache or fetched. Raises
+        requests.RequestException if the page isn't cached and
+        can't be fetched.
+    '''
+    if isinstance(cache, PageCache):
+        page, validators = cache.lookup(url)
+    else:
+        page, validators = cache.get(url), None
+    if page is not None and validators is None:
+        print("Retrieving stick")
+        PAGE_CACHE_REQUESTS.inc(result='hit')
+        PAGE_CACHE_BYTES.inc(len(page), result='hit')
+        return page
+    print("Throwing stick")
+    import requests
+    try:
+        # raises for 4xx and, after retrying, for 5xx, so an error page
+        # never replaces a good one
+        response = fetch_with_retry(get_session(), url, HOST_LIMITER, headers=validators)
+        if response.status_code == 304 and page is None:
+            raise requests.HTTPError(f'304 for {url}, which is not cached', response=response)
+    except requests.RequestException:
+        if page is None:
+            raise
+        print("Couldn't fetch the stick, keeping the old one")
+        return page
+    if response.status_code == 304:
+        cache.revalidated(url, *response_validators(response))
+        PAGE_CACHE_REQUESTS.inc(result='revalidated')
+        PAGE_CACHE_BYTES.inc(len(page), result='revalidated')
+        return page
+    if isinstance(cache, PageCache):
+        cache.put_many([(url, response.text) + response_validators(response)])
+    else:
+        cache[url] = response.text
+    PAGE_CACHE_REQUESTS.inc(result='miss')
+    PAGE_CACHE_BYTES.inc(len(response.text), result='miss')
+    return response.text
+
+SESSION = None
+SESSION_POOL_SIZE = 0
+
+def get_session(pool_size=CRAWL_WORKERS):
+    '''Returns the shared HTTP session, creating it on first use.
+    The session keeps connections alive between requests so the
+    crawler does not pay for a new TCP/TLS handshake per page.
+    
+    Parameters
+    ----------
+    pool_size: int
+        Number of pooled connections to keep per host. The pool is
+        made bigger when a caller wants more than the session has.
+    
+    Returns
+    -------
+    requests.Session
+        The shared session.
+    '''
+    global SESSION, SESSION_POOL_SIZE
+    if SESSION is None:
+        import requests
+        SESSION = requests.Session()
+        SESSION_POOL_SIZE = 0
+    if pool_size > SESSION_POOL_SIZE:
+        from requests.adapters import HTTPAdapter
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        SESSION.mount('http://', adapter)
+        SESSION.mount('https://', adapter)
+        SESSION_POOL_SIZE = pool_size
+    return SESSION
+
+class HostRateLimiter:
+    '''Spaces out requests to the same host by a minimum interval.
+    Safe to share between crawler threads.
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        '''Blocks until a request to the url's host is allowed.
+        
+        Parameters
+        ----------
+        url: string
+            The URL about to be requested.
+        
+        Returns
+        -------
+        None
+        '''
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# shared by every fetch, one page at a time or crawled, so together
+# they keep to CRAWL_HOST_INTERVAL
+HOST_LIMITER = HostRateLimiter(CRAWL_HOST_INTERVAL)
+
+def fetch_with_retry(session, url, limiter, retries=CRAWL_RETRIES, backoff=CRAWL_BACKOFF, headers=None):
+    '''Requests a url, retrying connection errors and 429/5xx responses
+    with exponential backoff.
+    
+    Parameters
+    ----------
+    session: requests.Session
+        The pooled session to send the request with.
+    url: string
+        The URL to fetch.
+    limiter: HostRateLimiter
+        Rate limiter shared by every crawler thread.
+    retries: int
+        Number of attempts after the first one fails.
+    backoff: float
+        Seconds to wait before the first retry. Doubles every attempt.
+    headers: dict
+        Extra request headers, like the conditional ones of a stale page.
+    
+    Returns
+    -------
+    requests.Response
+        The response, which is a 304 if a conditional request found
+        the page unchanged.
+    '''
+    import requests
+    for attempt in range(retries + 1):
+        limiter.wait(url)
+        try:
+            response = session.get(url, headers=headers, timeout=CRAWL_TIMEOUT)
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+                return response
+            error = requests.HTTPError(f'{response.status_code} for {url}', response=response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+    raise error
+
+def crawl_breed_pages(urls, cache, workers=CRAWL_WORKERS,
+        host_interval=CRAWL_HOST_INTERVAL, retries=CRAWL_RETRIES, backoff=CRAWL_BACKOFF):
+    '''Fetches every url that is not cached yet or stale using a pool
+    of worker threads and stores the pages in the cache, so the scraping
+    functions afterwards only read from the cache. Stale pages are
+    revalidated with conditional requests.
+    
+    Parameters
+    ----------
+    urls: iterable
+        The breed page URLs to fetch.
+    cache: PageCache
+        The page cache to fill.
+    workers: int
+        Number of pages fetched at the same time.
+    host_interval: float
+        Minimum seconds between two requests to the same host. At
+        CRAWL_HOST_INTERVAL the crawl shares HOST_LIMITER with the
+        other fetches.
+    retries: int
+        Number of retries for a failing page.
+    backoff: float
+        Seconds to wait before the first retry.
+    
+    Returns
+    -------
+    dict
+        URLs that could not be fetched as keys and the error as the value.
+    '''
+    import requests
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    due = cache.due(urls)
+    failed = {}
+    if not due:
+        return failed
+    print(f"Throwing {len(due)} sticks with {workers} dogs")
+    session = get_session(workers)
+    limiter = HOST_LIMITER if host_interval == HOST_LIMITER.interval else HostRateLimiter(host_interval)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_with_retry, session, url, limiter, retries, backoff, headers): url
+            for url, headers in due.items()
+        }
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                response = future.result()
+            except requests.RequestException as e:
+                failed[url] = e
+                continue
+            if response.status_code == 304 and not due[url]:
+                failed[url] = requests.HTTPError(f'304 for {url}, which is not cached')
+            elif response.status_code == 304:
+                cache.revalidated(url, *response_validators(response))
+                PAGE_CACHE_REQUESTS.inc(result='revalidated')
+            else:
+                cache.put_many([(url, response.text) + response_validators(response)])
+                PAGE_CACHE_REQUESTS.inc(result='miss')
+                PAGE_CACHE_BYTES.inc(len(response.text), result='miss')
+    return failed
+
+READ_POOL = queue.LifoQueue()
+READ_POOL_SIZE = 8
+READ_CACHE_KB = 16384             # page cache per connection
+READ_MMAP_BYTES = 256 * 1024 * 1024
+READ_STATEMENT_CACHE = 256        # enough for every search the forms can make
+
+def open_read_connection():
+    '''Opens a read-only connection to the dog database, tuned for
+    the query helpers.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    sqlite3.Connection
+        The new connection.
+    '''
+    # snapshots never change once published, so SQLite can skip locking
+    immutable = '&immutable=1' if DB_IMMUTABLE else ''
+    conn = sqlite3.connect(f'file:{DB_NAME}?mode=ro{immutable}', uri=True,
+        check_same_thread=False, cached_statements=READ_STATEMENT_CACHE)
+    conn.execute('PRAGMA query_only = ON')
+    conn.execute(f'PRAGMA cache_size = -{READ_CACHE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {READ_MMAP_BYTES}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+@contextmanager
+def read_connection():
+    '''Lends a pooled read-only connection for the length of a
+    with block. Connections are kept open between requests, so a
+    request doesn't pay for opening the database. Connections to a
+    database the app has since switched away from are closed instead
+    of going back to the pool. Every call may first switch the app
+    to a newly published snapshot, so each request reads the latest.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    sqlite3.Connection
+        A connection from the pool.
+    '''
+    check_snapshot()
+    path, conn = DB_NAME, None
+    while conn is None:
+        try:
+            pooled_path, conn = READ_POOL.get_nowait()
+        except queue.Empty:
+            conn = open_read_connection()
+        else:
+            if pooled_path != path:
+                conn.close()
+                conn = None
+    try:
+        yield conn
+    except BaseException:
+        # also when a streamed response is closed early, with the
+        # connection maybe in the middle of a query
+        conn.close()
+        raise
+    else:
+        if path == DB_NAME and READ_POOL.qsize() < READ_POOL_SIZE:
+            READ_POOL.put((path, conn))
+        else:
+            conn.close()
+
+def close_read_connections():
+    '''Closes every pooled connection. Runs when the app exits.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    None
+    '''
+    while True:
+        try:
+            READ_POOL.get_nowait()[1].close()
+        except queue.Empty:
+            break
+
+atexit.register(close_read_connections)
+
+GROUP_SORT_COLUMNS = {'rank': 'Rank', 'max_life': 'MaxLifeSpan', 'min_life': 'MinLifeSpan', 'number': 'Number'}
+GROUP_BY_COLUMNS = {
+    'breed group': ('G.BreedGroup', 'JOIN Groups AS G ON D.BreedGroupId=G.Id'),
+    'origin': ('C.Country', 'JOIN Countries AS C ON D.CountryId=C.Id'),
+    'size': ('D.Size', ''),
+    'barkiness': ('D.Barkiness', ''),
+}
+API_PAGE_SIZE = 50      # rows per page of the JSON APIs
+API_MAX_PAGE_SIZE = 500
+AUTOCOMPLETE_SIZE = 10
+SEARCH_WEIGHTS = (10.0, 1.0)     # bm25 weight of a match in Name and in OriginalPastime
+DOG_API_FIELDS = ['name', 'rank', 'country', 'breed_group', 'size', 'barkiness',
+    'min_lifespan', 'max_lifespan', 'url']
+GROUP_API_FIELDS = ['number', 'rank', 'min_lifespan', 'max_lifespan']
+
+def group_stats_key(group_by, then_by=None):
+    '''Finds the GroupStats rows for a grouping. Pairs of dimensions
+    are stored once, in the order of GROUP_BY_COLUMNS.
+    
+    Parameters
+    ----------
+    group_by: string
+        What the user wants to group by.
+    then_by: string
+        What the user wants to group by second, or None.
+    
+    Returns
+    -------
+    tuple
+        The GroupBy value of the rows and whether Value1 and Value2
+        are swapped compared to the order the user asked for.
+    '''
+    lookup_choice(GROUP_BY_COLUMNS, group_by, 'grouping')
+    if then_by is None or then_by == group_by:
+        return group_by, False
+    lookup_choice(GROUP_BY_COLUMNS, then_by, 'grouping')
+    dims = list(GROUP_BY_COLUMNS)
+    if dims.index(group_by) < dims.index(then_by):
+        return f'{group_by}|{then_by}', False
+    return f'{then_by}|{group_by}', True
+
+def group_stats_parts(grouping):
+    '''Finds what a GroupStats query of a grouping selects and joins.
+    
+    Parameters
+    ----------
+    grouping: tuple
+        One or two dimensions of GROUP_BY_COLUMNS, in their order.
+    
+    Returns
+    -------
+    tuple
+        The GroupBy value, the columns grouped by and the joins they need.
+    '''
+    columns = [GROUP_BY_COLUMNS[dim][0] for dim in grouping]
+    joins = ' '.join(GROUP_BY_COLUMNS[dim][1] for dim in grouping)
+    return '|'.join(grouping), columns, joins
+
+GROUP_STATS_AGGREGATES = '''COUNT(*), ROUND(AVG(Rank), 2),
+    ROUND(AVG(MinLifeSpan), 2), ROUND(AVG(MaxLifeSpan), 2)'''
+
+def build_group_stats(cur):
+    '''Fills the GroupStats table with the number of dogs and the
+    averages for every value of every grouping and pair of groupings,
+    so the /results page doesn't aggregate the Dogs table.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the transaction changing the catalog.
+    
+    Returns
+    -------
+    None
+    '''
+    cur.execute('DELETE FROM GroupStats')
+    dims = list(GROUP_BY_COLUMNS)
+    for grouping in [(dim,) for dim in dims] + list(itertools.combinations(dims, 2)):
+        key, columns, joins = group_stats_parts(grouping)
+        value_2 = columns[1] if len(columns) == 2 else 'NULL'
+        query = f'''
+        INSERT INTO GroupStats (GroupBy, Value1, Value2, Number, Rank, MinLifeSpan, MaxLifeSpan)
+        SELECT ?, {columns[0]}, {value_2}, {GROUP_STATS_AGGREGATES} FROM Dogs AS D
+        {joins} GROUP BY {', '.join(columns)}
+        '''
+        cur.execute(query, [key])
+
+def group_values(cur, names):
+    '''Reads the value of every grouping dimension of some breeds.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the transaction changing the catalog.
+    names: list
+        Breed names. Names not in Dogs are skipped.
+    
+    Returns
+    -------
+    set
+        A tuple per breed, with a value per dimension of
+        GROUP_BY_COLUMNS, in its order.
+    '''
+    key, columns, joins = group_stats_parts(tuple(GROUP_BY_COLUMNS))
+    return set(cur.execute(f'''
+    SELECT {', '.join(columns)} FROM Dogs AS D {joins}
+    WHERE D.Name IN (SELECT value FROM json_each(?))
+    ''', [json.dumps(names)]))
+
+def update_group_stats(cur, values):
+    '''Recomputes only the GroupStats rows of some group values, so
+    a refresh aggregates the dogs sharing a value with a changed
+    breed instead of the whole catalog. Rows that stay are updated in
+    place, keeping the Id that breaks ties in their sort order.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the transaction changing the catalog, after the
+        changes.
+    values: set
+        Group values from group_values of the changed and removed
+        breeds, from before the changes and after.
+    
+    Returns
+    -------
+    None
+    '''
+    dims = list(GROUP_BY_COLUMNS)
+    for grouping in [(dim,) for dim in dims] + list(itertools.combinations(dims, 2)):
+        key, columns, joins = group_stats_parts(grouping)
+        # the dogs sharing a first value are read once, for every touched
+        # second value at the same time. The + keeps SQLite from scanning
+        # a whole index in the order of the second value instead.
+        second = columns[1] if len(columns) == 2 else 'NULL'
+        aggregate = f'''
+        SELECT {second}, {GROUP_STATS_AGGREGATES} FROM Dogs AS D {joins}
+        WHERE {columns[0]} IS ? GROUP BY +{second}
+        '''
+        touched = {}
+        for value in values:
+            group = [value[dims.index(dim)] for dim in grouping] + [None]
+            touched.setdefault(group[0], set()).add(group[1])
+        for value_1, values_2 in touched.items():
+            stats = {row[0]: row[1:] for row in cur.execute(aggregate, [value_1])}
+            for value_2 in values_2:
+                row = cur.execute('''
+                SELECT Id FROM GroupStats WHERE GroupBy = ? AND Value1 IS ? AND Value2 IS ?
+                ''', [key, value_1, value_2]).fetchone()
+                if value_2 not in stats:
+                    if row is not None:
+                        cur.execute('DELETE FROM GroupStats WHERE Id = ?', row)
+                elif row is None:
+                    cur.execute('''
+                    INSERT INTO GroupStats (GroupBy, Value1, Value2, Number, Rank, MinLifeSpan, MaxLifeSpan)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', [key, value_1, value_2, *stats[value_2]])
+                else:
+                    cur.execute('''
+                    UPDATE GroupStats SET Number = ?, Rank = ?, MinLifeSpan = ?, MaxLifeSpan = ?
+                    WHERE Id = ?
+                    ''', [*stats[value_2], *row])
+
+def group_value_columns(key, swapped):
+    '''Lists the GroupStats value columns in the order the user grouped by.
+    
+    Parameters
+    ----------
+    key: string
+        The GroupBy value, from group_stats_key.
+    swapped: bool
+        Whether Value1 and Value2 are swapped, from group_stats_key.
+    
+    Returns
+    -------
+    string
+        The columns to select.
+    '''
+    if '|' not in key:
+        return 'Value1'
+    return 'Value2, Value1' if swapped else 'Value1, Value2'
+
+SIMILAR_K = 10     # similar breeds stored per breed
+SIMILAR_REFRESH_SHARE = 0.01    # share of changed breeds above which a refresh rebuilds Similar
+
+def build_similar(cur, k=SIMILAR_K):
+    '''Fills the Similar table with the k nearest breeds of every
+    breed, so serving them is a lookup. Left empty without numpy.
+    The scale of the numbers is kept in CatalogInfo for update_similar.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the transaction changing the catalog.
+    k: int
+        Number of similar breeds per breed.
+    
+    Returns
+    -------
+    None
+    '''
+    cur.execute('DELETE FROM Similar')
+    cur.execute("DELETE FROM CatalogInfo WHERE Key = 'SimilarScale'")
+    try:
+        import similar
+    except ImportError:
+        print("No numpy, so no sniffing out similar breeds")
+        return
+    rows = cur.execute('''
+    SELECT Id, Size, Barkiness, BreedGroupId, CountryId, Rank, MinLifespan, MaxLifespan
+    FROM Dogs ORDER BY Id
+    ''').fetchall()
+    scale = similar.number_scale(rows)
+    cur.executemany('INSERT INTO Similar VALUES (?, ?, ?, ?)', similar.nearest_breeds(rows, k, scale))
+    cur.execute("INSERT INTO CatalogInfo VALUES ('SimilarScale', ?)", [json.dumps(scale)])
+
+def update_similar(cur, changed, removed, k=SIMILAR_K):
+    '''Brings the Similar table up to date after some breeds changed,
+    finding neighbours again only where they can have moved. Numbers
+    are scaled the way the last build_similar scaled them, so results
+    match a full build until a breed brings a number outside the old
+    ranges, which rebuilds the table. So does a refresh touching more
+    than SIMILAR_REFRESH_SHARE of the catalog, where a full build is
+    quicker.
+    
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        Cursor of the transaction changing the catalog, after the
+        changes.
+    changed: list
+        Ids of the new and changed breeds.
+    removed: list
+        Ids the removed breeds had.
+    k: int
+        Number of similar breeds per breed.
+    
+    Returns
+    -------
+    None
+    '''
+    try:
+        import similar
+    except ImportError:
+        return build_similar(cur, k)
+    scale = cur.execute("SELECT Value FROM CatalogInfo WHERE Key = 'SimilarScale'").fetchone()
+    dogs = cur.execute('SELECT COUNT(*) FROM Dogs').fetchone()[0]
+    # every breed that stays has to have a full list to build on
+    kept = cur.execute('''
+    SELECT COUNT(*) FROM Similar
+    WHERE DogId IN (SELECT Id FROM Dogs) AND DogId NOT IN (SELECT value FROM json_each(?))
+    ''', [json.dumps(changed)]).fetchone()[0]
+    if (scale is None or dogs <= k or kept != k * (dogs - len(changed))
+            or len(changed) + len(removed) > SIMILAR_REFRESH_SHARE * dogs):
+        return build_similar(cur, k)
+    scale = json.loads(scale[0])
+    rows = cur.execute('''
+    SELECT Id, Size, Barkiness, BreedGroupId, CountryId, Rank, MinLifespan, MaxLifespan
+    FROM Dogs ORDER BY Id
+    ''').fetchall()
+    changed_set = set(changed)
+    if not similar.within([row for row in rows if row[0] in changed_set], scale):
+        return build_similar(cur, k)
+    cur.execute('DELETE FROM Similar WHERE DogId IN (SELECT value FROM json_each(?))',
+        [json.dumps(removed)])
+    stale = [row[0] for row in cur.execute('''
+    SELECT DISTINCT DogId FROM Similar WHERE SimilarId IN (SELECT value FROM json_each(?))
+    ''', [json.dumps(changed + removed)])]
+    kth = cur.execute('SELECT DogId, Distance FROM Similar WHERE Position = ?', [k - 1]).fetchall()
+
+    def load(dog_ids):
+        return [row[0] for row in cur.connection.execute('''
+        SELECT SimilarId FROM Similar WHERE DogId IN (SELECT value FROM json_each(?))
+        ORDER BY DogId, Position
+        ''', [json.dumps(dog_ids)])]
+
+    cur.executemany('INSERT OR REPLACE INTO Similar VALUES (?, ?, ?, ?)',
+        similar.update_nearest_breeds(rows, k, scale, changed, stale, kth, load))
+
+@timed_query()
+def get_similar_dogs(name, limit=SIMILAR_K):
+    '''Looks up the breeds most like a breed.
+    
+    Parameters
+    ----------
+    name: string
+        Name of the breed.
+    limit: int
+        Number of breeds to return.
+    
+    Returns
+    -------
+    list
+        The similar dogs as tuples in the same format as
+        get_dog_results_sql, closest first, each followed by its
+        distance.
     '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
     query = '''
-    SELECT DISTINCT(Size) FROM Dogs
+    SELECT D.Name, D.Rank, C.Country, G.BreedGroup, D.Size, D.Barkiness, D.MinLifespan, D.MaxLifespan,
+    D.Url, S.Distance FROM Dogs AS B
+    JOIN Similar AS S ON S.DogId=B.Id JOIN Dogs AS D ON S.SimilarId=D.Id
+    JOIN Countries AS C ON D.CountryId=C.Id JOIN Groups AS G ON D.BreedGroupId=G.Id
+    WHERE B.Name = ? ORDER BY S.Position LIMIT ?
+    '''
+    with read_connection() as conn:
+        return conn.execute(query, [name, limit]).fetchall()
+
+def group_results_query(group_by, sort_order, sort_by, then_by=None):
+    '''Constructs a SQL query when the user searches by grouping.
+    
+    Parameters
+    ----------
+    group_by: string
+        String representation of html form. What the user
+        wants to group by.
+    sort_order: string
+        String representation of html form. How the user
+        wants to sort data.
+    sort_by: string
+        String representation of html form. Sort by
+        numerical data.
+    then_by: string
+        String representation of html form. What the user
+        wants to group by second. None for one grouping.
+
+    Returns
+    -------
+    tuple
+        the query and the list of values to bind to it.
+    '''
+    key, swapped = group_stats_key(group_by, then_by)
+    sort_by = lookup_choice(GROUP_SORT_COLUMNS, sort_by, 'sort')
+    sort_order = lookup_choice(SORT_DIRECTIONS, sort_order, 'sort direction')
+    select = group_value_columns(key, swapped)
+    query = f'''
+    SELECT {select}, Number, Rank, MinLifeSpan, MaxLifeSpan FROM GroupStats
+    WHERE GroupBy = ? AND {sort_by} IS NOT NULL ORDER BY {sort_by} {sort_order} LIMIT 10
+    '''
+    return query, [key]
+
+@timed_query()
+def get_group_results_sql(group_by, sort_order, sort_by, then_by=None):
+    '''Runs the SQL query when the user searches by grouping.
+    
+    Parameters
+    ----------
+    group_by: string
+        String representation of html form. What the user
+        wants to group by.
+    sort_order: string
+        String representation of html form. How the user
+        wants to sort data.
+    sort_by: string
+        String representation of html form. Sort by
+        numerical data.
+    then_by: string
+        String representation of html form. What the user
+        wants to group by second. None for one grouping.
+
+    Returns
+    -------
+    tuple
+        the results of the query as a nested tuple.
+    '''
+    query, params = group_results_query(group_by, sort_order, sort_by, then_by)
+    with read_connection() as conn:
+        results = conn.execute(query, params).fetchall()
+    return results
+
+def dog_filter_clauses(filters):
+    '''Turns the filters that are set into WHERE conditions.
+    
+    Parameters
+    ----------
+    filters: dict
+        Form field as the key and the form value as the value,
+        for the fields in DOG_FILTERS. Missing fields aren't filtered.
+    
+    Returns
+    -------
+    tuple
+        the list of conditions and the list of values to bind to them.
+    '''
+    where = []
+    params = []
+    for field, column, everything in DOG_FILTERS:
+        value = filters.get(field, everything)
+        if value != everything:
+            where.append(f'{column} = ?')
+            params.append(value)
+    return where, params
+
+def build_dog_query(sort_by, sort_order, filters, limit):
+    '''Constructs a parameterized SQL query when the user searches by dog.
+    The query text only depends on the sort and on which filters are
+    set, so SQLite can reuse the prepared statement for every search
+    with the same shape. Ties are broken by Id so the order is stable.
+    
+    Parameters
+    ----------
+    sort_by: string
+        String representation of html form. Sort by
+        numerical data.
+    sort_order: string
+        String representation of html form. How the user
+        wants to sort data.
+    filters: dict
+        Form field as the key and the form value as the value,
+        for the fields in DOG_FILTERS. Missing fields aren't filtered.
+    limit: string
+        Number of rows that the user requests, or None for every row.
+
+    Returns
+    -------
+    tuple
+        the query and the list of values to bind to it.
+    '''
+    sort_by = lookup_choice(DOG_SORT_COLUMNS, sort_by, 'sort')
+    sort_order = lookup_choice(SORT_DIRECTIONS, sort_order, 'sort direction')
+    where, params = dog_filter_clauses(filters)
+    where = 'WHERE ' + ' AND '.join(where) if where else ''
+    params.append(-1 if limit is None else parse_limit(limit)) # SQLite reads LIMIT -1 as no limit
+    query = f'''
+    SELECT D.Name, D.Rank, C.Country, G.BreedGroup, D.Size, D.Barkiness, D.MinLifespan, D.MaxLifespan,
+    D.Url FROM Dogs AS D
+    JOIN Countries AS C ON D.CountryId=C.Id JOIN Groups AS G ON D.BreedGroupId=G.Id
+    {where} ORDER BY {sort_by} {sort_order}, D.Id {sort_order} LIMIT ?
+    '''
+    return query, params
+
+@timed_query()
+def get_dog_results_sql(sort_by, sort_order, region, size, breed_group, bark, limit):
+    '''Runs the SQL query when the user searches by dog.
+    
+    Parameters
+    ----------
+    sort_by: string
+        String representation of html form. Sort by
+        numerical data.
+    sort_order: string
+        String representation of html form. How the user
+        wants to sort data.
+    region: string
+        String representation of html form. Filter by
+        region of origion.
+    size: string
+        String representation of html form. Filter by dog size.
+    breed_group: string
+        String representation of html form. Filter by breed group.
+    bark: string
+        String representation of html form. Filter by noise level.
+    limit: int
+        Integer representing number of rows that the user requests.
+
+    Returns
+    -------
+    tuple
+        the results of the query as a nested tuple.
+    '''
+    filters = {'region': region, 'size': size, 'breed_group': breed_group, 'barkiness': bark}
+    query, params = build_dog_query(sort_by, sort_order, filters, limit)
+    with read_connection() as conn:
+        results = conn.execute(query, params).fetchall()
+    return results
+
+def parse_page_size(limit):
+    '''Turns the limit of an API request into a page size. Limits over
+    API_MAX_PAGE_SIZE are cut down to it.
+    
+    Parameters
+    ----------
+    limit: string
+        The limit from the request. Empty means API_PAGE_SIZE.
+    
+    Returns
+    -------
+    int
+        The number of rows per page.
+    '''
+    if not limit:
+        return API_PAGE_SIZE
+    return min(parse_limit(limit), API_MAX_PAGE_SIZE)
+
+SQLITE_MIN_INT = -2 ** 63
+SQLITE_MAX_INT = 2 ** 63 - 1
+
+def encode_cursor(value, row_id):
+    '''Makes the cursor of the page after a row.
+    
+    Parameters
+    ----------
+    value: int, float, string or None
+        The sort value of the last row of the page.
+    row_id: int
+        The Id of the last row of the page.
+    
+    Returns
+    -------
+    string
+        The cursor, safe to put in a URL.
+    '''
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    '''Reads a cursor made by encode_cursor.
+    
+    Parameters
+    ----------
+    cursor: string
+        The cursor, or None or empty for the first page.
+    
+    Returns
+    -------
+    tuple
+        The sort value and Id of the last row of the previous page,
+        or None for the first page.
+    '''
+    if not cursor:
+        return None
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    after = json.loads(raw)
+    if (not isinstance(after, list) or len(after) != 2 or type(after[1]) is not int
+            or not isinstance(after[0], (int, float, str, type(None)))):
+        raise ValueError('invalid cursor')
+    value, row_id = after
+    # json reads NaN and Infinity, and SQLite can't bind ints past 64 bits
+    if ((isinstance(value, float) and not math.isfinite(value))
+            or any(type(n) is int and not SQLITE_MIN_INT <= n <= SQLITE_MAX_INT for n in after)):
+        raise ValueError('invalid cursor')
+    return value, row_id
+
+def seek_clauses(sort_by, sort_order, after, id_column):
+    '''Makes the conditions that find the rows after the last row of the
+    previous page, so a page is read straight from an index however
+    deep it is. The rows are split in parts that each seek the index
+    on their own: the rest of the rows tied with the last row, the
+    rows past its sort value, and the NULLs, which SQLite sorts first
+    ascending and last descending.
+    
+    Parameters
+    ----------
+    sort_by: string
+        The sort column.
+    sort_order: string
+        'ASC' or 'DESC'.
+    after: tuple
+        The sort value and Id of the last row of the previous page,
+        or None for the first page.
+    id_column: string
+        The Id column the sort is broken by.
+    
+    Returns
+    -------
+    list
+        (condition, values to bind to it) for every part, in the order
+        the parts are read.
+    '''
+    if after is None:
+        return [('', [])]
+    value, row_id = after
+    if sort_order == 'ASC':
+        if value is None:
+            return [(f'{sort_by} IS NULL AND {id_column} > ?', [row_id]),
+                (f'{sort_by} IS NOT NULL', [])]
+        return [(f'{sort_by} = ? AND {id_column} > ?', [value, row_id]),
+            (f'{sort_by} > ?', [value])]
+    if value is None:
+        return [(f'{sort_by} IS NULL AND {id_column} < ?', [row_id])]
+    return [(f'{sort_by} = ? AND {id_column} < ?', [value, row_id]),
+        (f'{sort_by} < ?', [value]), (f'{sort_by} IS NULL', [])]
+
+def build_dog_page_query(sort_by, sort_order, filters, after=None):
+    '''Constructs the queries for a page of /api/dogs. Pages are sorted
+    by the sort column and then Id and continue after the last row of
+    the previous page instead of using OFFSET.
+    
+    Parameters
+    ----------
+    sort_by: string
+        Sort by numerical data, like the /dogs form.
+    sort_order: string
+        'asc' or 'desc'.
+    filters: dict
+        Form field as the key and the form value as the value,
+        for the fields in DOG_FILTERS. Missing fields aren't filtered.
+    after: tuple
+        The sort value and Id of the last row of the previous page,
+        or None for the first page.
+
+    Returns
+    -------
+    list
+        (query, values to bind to it) for every part of seek_clauses.
+        The row limit is bound last, and every row ends with its sort
+        value and Id.
+    '''
+    sort_by = lookup_choice(DOG_SORT_COLUMNS, sort_by, 'sort')
+    sort_order = lookup_choice(SORT_DIRECTIONS, sort_order, 'sort direction')
+    parts = []
+    for seek, seek_params in seek_clauses(sort_by, sort_order, after, 'D.Id'):
+        where, params = dog_filter_clauses(filters)
+        if seek:
+            where.append(seek)
+        where = 'WHERE ' + ' AND '.join(where) if where else ''
+        query = f'''
+        SELECT D.Name, D.Rank, C.Country, G.BreedGroup, D.Size, D.Barkiness, D.MinLifespan,
+        D.MaxLifespan, D.Url, {sort_by}, D.Id FROM Dogs AS D
+        JOIN Countries AS C ON D.CountryId=C.Id JOIN Groups AS G ON D.BreedGroupId=G.Id
+        {where} ORDER BY {sort_by} {sort_order}, D.Id {sort_order} LIMIT ?
+        '''
+        parts.append((query, params + seek_params))
+    return parts
+
+def build_group_page_query(group_by, sort_order, sort_by, then_by=None, after=None):
+    '''Constructs the queries for a page of /api/groups, paged the same
+    way as build_dog_page_query. Groups without a value to sort by
+    are left out, like on the /results page.
+    
+    Parameters
+    ----------
+    group_by: string
+        What the user wants to group by.
+    sort_order: string
+        'asc' or 'desc'.
+    sort_by: string
+        Sort by numerical data, like the /groupings form.
+    then_by: string
+        What the user wants to group by second, or None.
+    after: tuple
+        The sort value and Id of the last row of the previous page,
+        or None for the first page.
+
+    Returns
+    -------
+    list
+        (query, values to bind to it) for every part of seek_clauses.
+        The row limit is bound last, and every row ends with its sort
+        value and Id.
+    '''
+    key, swapped = group_stats_key(group_by, then_by)
+    sort_by = lookup_choice(GROUP_SORT_COLUMNS, sort_by, 'sort')
+    sort_order = lookup_choice(SORT_DIRECTIONS, sort_order, 'sort direction')
+    select = group_value_columns(key, swapped)
+    parts = []
+    for seek, seek_params in seek_clauses(sort_by, sort_order, after, 'Id'):
+        where = f'GroupBy = ? AND {sort_by} IS NOT NULL' + (f' AND {seek}' if seek else '')
+        query = f'''
+        SELECT {select}, Number, Rank, MinLifeSpan, MaxLifeSpan, {sort_by}, Id FROM GroupStats
+        WHERE {where} ORDER BY {sort_by} {sort_order}, Id {sort_order} LIMIT ?
+        '''
+        parts.append((query, [key] + seek_params))
+    return parts
+
+@timed_query(rows=lambda page: len(page['results']))
+def get_page(parts, fields, page_size):
+    '''Runs the queries of a page in order until the page is full, and
+    shapes the page for the JSON APIs. One row more than the page is
+    read, to tell if there is a next page.
+    
+    Parameters
+    ----------
+    parts: list
+        Queries made by build_dog_page_query or build_group_page_query.
+    fields: list
+        Names of the columns of every row, without the sort value and Id.
+    page_size: int
+        Number of rows per page.
+    
+    Returns
+    -------
+    dict
+        The rows as dicts and the cursor of the next page, which is
+        None on the last page.
+    '''
+    rows = []
+    with read_connection() as conn:
+        for query, params in parts:
+            rows.extend(conn.execute(query, params + [page_size + 1 - len(rows)]).fetchall())
+            if len(rows) > page_size:
+                break
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(*rows[-1][-2:])
+    return {
+        'results': [dict(zip(fields, row[:-2])) for row in rows],
+        'limit': page_size,
+        'next': next_cursor,
+    }
+
+def full_text_query(text, prefix=False, column=None):
+    '''Turns what the user typed into an FTS5 query that matches every
+    word. Each word is quoted, so no FTS5 syntax gets through.
+    
+    Parameters
+    ----------
+    text: string
+        What the user typed.
+    prefix: bool
+        Whether the last word may be the start of a longer word.
+    column: string
+        Column to match in, or None for every column.
+    
+    Returns
+    -------
+    string
+        The query, or None if the text has no words.
+    '''
+    words = [f'"{word}"' for word in re.findall(r'\w+', text.lower())]
+    if not words:
+        return None
+    if prefix:
+        words[-1] += '*'
+    query = ' '.join(words)
+    return f'{column} : ({query})' if column else query
+
+@timed_query()
+def search_breeds(text, limit):
+    '''Finds breeds by words in their name or original pastime, best
+    matches first. Matches in the name count more.
+    
+    Parameters
+    ----------
+    text: string
+        What the user typed.
+    limit: int
+        Number of breeds to return.
+    
+    Returns
+    -------
+    list
+        Name, original pastime, url and score of the matching breeds.
+    '''
+    match = full_text_query(text)
+    if match is None:
+        return []
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+    query = f'''
+    SELECT D.Name, D.OriginalPastime, D.Url, ROUND(bm25(DogsSearch, {weights}), 4) AS Score
+    FROM DogsSearch JOIN Dogs AS D ON D.Id = DogsSearch.rowid
+    WHERE DogsSearch MATCH ? ORDER BY Score LIMIT ?
+    '''
+    with read_connection() as conn:
+        return conn.execute(query, [match, limit]).fetchall()
+
+@timed_query()
+def autocomplete_breeds(text, limit=AUTOCOMPLETE_SIZE):
+    '''Finds breed names with a word starting with each word typed so
+    far. Names come out in Id order, so the index stops after the first
+    limit matches instead of ranking all of them. That is the order of
+    the breed list at the last full build, with breeds added by later
+    refreshes after it, so the suggestions aren't always alphabetical.
+    
+    Parameters
+    ----------
+    text: string
+        What the user typed so far.
+    limit: int
+        Number of names to return.
+    
+    Returns
+    -------
+    list
+        The matching breed names.
+    '''
+    match = full_text_query(text, prefix=True, column='Name')
+    if match is None:
+        return []
+    with read_connection() as conn:
+        rows = conn.execute('SELECT Name FROM DogsSearch WHERE DogsSearch MATCH ? LIMIT ?',
+            [match, limit]).fetchall()
+    return [row[0] for row in rows]
+
+SEARCH_ENGINE = os.environ.get('DOG_SEARCH_ENGINE', 'sql') # 'sql' or 'columnar'
+COLUMNAR = (None, None)         # (catalog version, ColumnarCatalog)
+COLUMNAR_LOCK = threading.Lock()
+
+def get_columnar_catalog():
+    '''Returns the in-memory column store of the catalog, loading it
+    again when the catalog version changes.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    ColumnarCatalog
+        The column store.
     '''
-    results = cur.execute(query).fetchall()
-    conn.close()
-    size_list = []
-    for item in results:
-        for x in item:
-            size_list.append(x)
-    size_list.sort()
-    return size_list
+    global COLUMNAR
+    version = catalog_version()
+    if COLUMNAR[0] == version:
+        return COLUMNAR[1]
+    with COLUMNAR_LOCK:
+        if COLUMNAR[0] != version:
+            import columnar
+            with read_connection() as conn:
+                COLUMNAR = (version, columnar.ColumnarCatalog.from_db(conn))
+    return COLUMNAR[1]
+
+def search_dogs(sort_by, sort_order, region, size, breed_group, bark, limit):
+    '''Searches dogs with the engine picked by SEARCH_ENGINE. Both
+    engines return the same rows.
+    
+    Parameters
+    ----------
+    Same as get_dog_results_sql.
+
+    Returns
+    -------
+    list
+        the matching dogs as tuples.
+    '''
+    if SEARCH_ENGINE == 'columnar':
+        filters = {'region': region, 'size': size, 'breed_group': breed_group, 'barkiness': bark}
+        return get_columnar_catalog().search(sort_by, sort_order, filters, limit)
+    return get_dog_results_sql(sort_by, sort_order, region, size, breed_group, bark, limit)
+
+CATALOG_CHECK_INTERVAL = 1.0  # seconds between checks for a new catalog version
+CATALOG_VERSION = None
+CATALOG_CHECKED = 0.0
+FACETS = (None, None)           # (catalog version, facets)
+FACET_LOCK = threading.Lock()
+
+def catalog_version():
+    '''Returns the version of the catalog. The version is read from
+    the database at most once every CATALOG_CHECK_INTERVAL seconds,
+    or right after this process changed the catalog.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    string
+        The catalog version.
+    '''
+    global CATALOG_VERSION, CATALOG_CHECKED
+    now = time.monotonic()
+    if CATALOG_VERSION is None or now - CATALOG_CHECKED > CATALOG_CHECK_INTERVAL:
+        try: # read_connection switches to a new snapshot first
+            with read_connection() as conn:
+                row = conn.execute("SELECT Value FROM CatalogInfo WHERE Key = 'Version'").fetchone()
+        except sqlite3.OperationalError:
+            row = None # database made before catalog versions
+        # snapshots are copies of each other, so their name is part of the version
+        CATALOG_VERSION = f"{os.path.basename(DB_NAME)}:{row[0] if row else 0}"
+        CATALOG_CHECKED = now
+    return CATALOG_VERSION
+
+def invalidate_catalog_version():
+    '''Makes the next catalog_version call read the version again.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    None
+    '''
+    global CATALOG_VERSION
+    CATALOG_VERSION = None
+
+def current_snapshot():
+    '''Returns the snapshot that CATALOG_POINTER names.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    string
+        Path of the latest published snapshot, or None if no snapshot
+        has been built.
+    '''
+    try:
+        with open(CATALOG_POINTER) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(CATALOG_DIR, name)
+    return path if name and os.path.exists(path) else None
+
+def follow_snapshot():
+    '''Switches the app to the latest snapshot if a newer one has been
+    published. Requests that already hold a connection finish on the
+    old snapshot; every request after the switch reads the new one.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    bool
+        True if the app switched snapshots.
+    '''
+    global DB_NAME, DB_IMMUTABLE
+    path = current_snapshot()
+    if path is None or path == DB_NAME:
+        return False
+    DB_NAME, DB_IMMUTABLE = path, True
+    return True
+
+SNAPSHOT_CHECKED = 0.0
+
+def check_snapshot():
+    '''Follows a newly published snapshot, looking for one at most once
+    every CATALOG_CHECK_INTERVAL seconds. read_connection calls it, so
+    a process that only serves the APIs or exports switches too.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    bool
+        True if the app switched snapshots.
+    '''
+    global SNAPSHOT_CHECKED
+    now = time.monotonic()
+    if not FOLLOW_SNAPSHOTS or now - SNAPSHOT_CHECKED <= CATALOG_CHECK_INTERVAL:
+        return False
+    SNAPSHOT_CHECKED = now
+    if not follow_snapshot():
+        return False
+    invalidate_catalog_version()
+    return True
+
+def use_database(path):
+    '''Points the app at one database and stops it from following
+    published snapshots, for scripts that build or read a catalog of
+    their own.
+    
+    Parameters
+    ----------
+    path: string
+        Path of the dog database.
+    
+    Returns
+    -------
+    None
+    '''
+    global DB_NAME, DB_IMMUTABLE, FOLLOW_SNAPSHOTS
+    DB_NAME, DB_IMMUTABLE, FOLLOW_SNAPSHOTS = path, False, False
+    close_read_connections()
+    invalidate_catalog_version()
+
+def get_facets():
+    '''Finds every value of each /dogs filter and how many dogs have
+    it. The result is computed once per catalog version, so rendering
+    the form normally doesn't query the database.
+    
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict
+        Form field from DOG_FILTERS as the key and a sorted list of
+        (value, number of dogs) tuples as the value.
+    '''
+    global FACETS
+    version = catalog_version()
+    if FACETS[0] == version:
+        return FACETS[1]
+    with FACET_LOCK:
+        if FACETS[0] == version:
+            return FACETS[1]
+        facets = count_facets()
+        FACETS = (version, facets)
+    return facets
+
+@timed_query(rows=lambda facets: sum(len(values) for values in facets.values()))
+def count_facets():
+    '''Runs the queries behind get_facets.
+    
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict
+        Same as get_facets.
+    '''
+    facets = {}
+    with read_connection() as conn:
+        for field, column, everything in DOG_FILTERS:
+            query = f'''
+            SELECT {column}, COUNT(*) FROM Dogs AS D
+            JOIN Countries AS C ON D.CountryId=C.Id JOIN Groups AS G ON D.BreedGroupId=G.Id
+            GROUP BY {column} ORDER BY {column}
+            '''
+            facets[field] = conn.execute(query).fetchall()
+    return facets
+
+def get_barkiness():
+    '''Finds all bark levels in the catalog.
+    
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list
+        list of all bark levels.
+    '''
+    return [bark for bark, count in get_facets()['barkiness']]
+
+def get_sizes():
+    '''Finds all dog sizes in the catalog.
+    
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list
+        list of all dog sizes.
+    '''
+    return [size for size, count in get_facets()['size']]
 
 def get_breedgroups():
-    '''Uses SQL database to find all unique instances
-    in a column.
+    '''Finds all breed groups in the catalog.
     
     Parameters
     ----------
@@ -649,23 +2519,10 @@ def get_breedgroups():
     list
         list of all breed groups.
     '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    query = '''
-    SELECT DISTINCT(BreedGroup) FROM Groups
-    '''
-    results = cur.execute(query).fetchall()
-    conn.close()
-    group_list = []
-    for item in results:
-        for x in item:
-            group_list.append(x)
-    group_list.sort()
-    return group_list
+    return [group for group, count in get_facets()['breed_group']]
 
 def get_countries():
-    '''Uses SQL database to find all unique instances
-    in a column.
+    '''Finds all origins in the catalog.
     
     Parameters
     ----------
@@ -676,19 +2533,137 @@ def get_countries():
     list
         list of all origins.
     '''
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    query = '''
-    SELECT DISTINCT(Country) FROM Countries
+    return [country for country, count in get_facets()['region']]
+
+ASSET_DIR = 'assets'             # precompressed copies of plotly.js
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+PLOTLY_JS = None
+
+def get_plotly_js():
+    '''Finds plotly.js in the plotly package and writes gzip (and brotli,
+    if installed) copies of it next to each other in ASSET_DIR. The file
+    names include a hash of plotly.js, so browsers can cache it forever.
+    Runs once per process.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    dict
+        'digest' of plotly.js and the 'identity', 'gzip' and 'br'
+        file paths that exist.
     '''
-    results = cur.execute(query).fetchall()
-    conn.close()
-    country_list = []
-    for item in results:
-        for x in item:
-            country_list.append(x)
-    country_list.sort()
-    return country_list
+    global PLOTLY_JS
+    if PLOTLY_JS is not None:
+        return PLOTLY_JS
+    package = importlib.util.find_spec('plotly').submodule_search_locations[0]
+    source = os.path.join(package, 'package_data', 'plotly.min.js')
+    with open(source, 'rb') as js_file:
+        js = js_file.read()
+    digest = hashlib.sha1(js).hexdigest()[:12]
+    os.makedirs(ASSET_DIR, exist_ok=True)
+    files = {'identity': source}
+    compressors = {'gzip': ('gz', lambda data: gzip.compress(data, 9))}
+    if importlib.util.find_spec('brotli') is not None:
+        import brotli
+        compressors['br'] = ('br', lambda data: brotli.compress(data, quality=11))
+    for encoding, (extension, compress) in compressors.items():
+        path = os.path.abspath(os.path.join(ASSET_DIR, f'plotly-{digest}.min.js.{extension}'))
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as compressed:
+                compressed.write(compress(js))
+            os.replace(tmp, path)
+        files[encoding] = path
+    PLOTLY_JS = dict(files, digest=digest)
+    return PLOTLY_JS
+
+def render_plot(x_vals, y_vals):
+    '''Renders a bar chart page. Only the figure is sent with the
+    page, plotly.js is loaded from its own cached URL.
+    
+    Parameters
+    ----------
+    x_vals: list
+        Bar labels.
+    y_vals: list
+        Bar heights.
+    
+    Returns
+    -------
+    string
+        The rendered page.
+    '''
+    figure = {'data': [{'type': 'bar', 'x': x_vals, 'y': y_vals}], 'layout': {}}
+    plotly_js = url_for('plotly_js', digest=get_plotly_js()['digest'])
+    return render_template('plot.html', figure=figure, plotly_js=plotly_js)
+
+@app.route('/assets/plotly-<digest>.min.js')
+def plotly_js(digest):
+    files = get_plotly_js()
+    if digest != files['digest']:
+        abort(404)
+    accepted = request.accept_encodings
+    for encoding in ['br', 'gzip', 'identity']:
+        if encoding in files and (encoding == 'identity' or accepted[encoding]):
+            break
+    response = send_file(files[encoding], mimetype='text/javascript', max_age=ASSET_MAX_AGE,
+        etag=f'{digest}-{encoding}')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.immutable = True
+    response.cache_control.public = True
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    '''Records how long a request took by route, and logs it if it
+    took longer than SLOW_REQUEST_MS.
+    
+    Parameters
+    ----------
+    response: flask.Response
+        The response to the request.
+    
+    Returns
+    -------
+    flask.Response
+        The same response.
+    '''
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    rule = request.url_rule
+    route = rule.rule if rule is not None else 'unmatched'
+    if rule is not None and rule.endpoint in PLOT_ENDPOINTS and request.values.get('plot'):
+        route += '?plot'
+    REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=str(response.status_code))
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        app.logger.warning('Slow walk: %s %s took %.1f ms, %d queries in %.1f ms', request.method,
+            request.full_path.rstrip('?'), elapsed * 1000, g.get('queries', 0), g.get('query_seconds', 0.0) * 1000)
+    return response
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    started = g.get('template_started')
+    if started:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - started.pop(), template=template.name)
+
+@app.route('/metrics')
+def metrics_page():
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -696,30 +2671,189 @@ def index():
 
 @app.route('/dogs')
 def dogs():
-    bark_list = get_barkiness()
-    size_list = get_sizes()
-    group_list = get_breedgroups()
-    country_list = get_countries()
-    return render_template('dogs.html', bark_list=bark_list, size_list=size_list,
-            group_list=group_list, country_list=country_list)
+    facets = get_facets()
+    return render_template('dogs.html', bark_list=facets['barkiness'], size_list=facets['size'],
+            group_list=facets['breed_group'], country_list=facets['region'])
+
+@app.route('/api/facets')
+def facet_counts():
+    filters = {field: request.args.get(field, everything)
+        for field, column, everything in DOG_FILTERS}
+    try:
+        catalog = get_columnar_catalog()
+    except ImportError:
+        abort(501) # needs numpy
+    return catalog.bitmaps.option_counts(filters)
+
+@app.route('/api/dogs')
+def api_dogs():
+    filters = {field: request.args.get(field, everything)
+        for field, column, everything in DOG_FILTERS}
+    try:
+        page_size = parse_page_size(request.args.get('limit', ''))
+        parts = build_dog_page_query(request.args.get('sort', 'rank'),
+            request.args.get('dir', 'asc'), filters, decode_cursor(request.args.get('cursor')))
+    except ValueError as e:
+        abort(400, str(e))
+    return get_page(parts, DOG_API_FIELDS, page_size)
+
+@app.route('/api/groups')
+def api_groups():
+    group_by = request.args.get('group', 'breed group')
+    then_by = request.args.get('then', 'none')
+    if then_by == 'none' or then_by == group_by:
+        then_by = None
+    try:
+        page_size = parse_page_size(request.args.get('limit', ''))
+        parts = build_group_page_query(group_by, request.args.get('dir', 'desc'),
+            request.args.get('sort', 'rank'), then_by, decode_cursor(request.args.get('cursor')))
+    except ValueError as e:
+        abort(400, str(e))
+    fields = [group_by] if then_by is None else [group_by, then_by]
+    return get_page(parts, fields + GROUP_API_FIELDS, page_size)
+
+@app.route('/api/search')
+def api_search():
+    try:
+        limit = parse_page_size(request.args.get('limit', ''))
+    except ValueError as e:
+        abort(400, str(e))
+    rows = search_breeds(request.args.get('q', ''), limit)
+    return {'results': [dict(zip(['name', 'original_pastime', 'url', 'score'], row)) for row in rows]}
+
+@app.route('/api/autocomplete')
+def api_autocomplete():
+    try:
+        limit = min(parse_limit(request.args.get('limit', '')), AUTOCOMPLETE_SIZE)
+    except ValueError as e:
+        abort(400, str(e))
+    return {'results': autocomplete_breeds(request.args.get('q', ''), limit)}
+
+@app.route('/api/similar')
+def api_similar():
+    try:
+        limit = min(parse_limit(request.args.get('limit', '')), SIMILAR_K)
+    except ValueError as e:
+        abort(400, str(e))
+    rows = get_similar_dogs(request.args.get('name', ''), limit)
+    return {'results': [dict(zip(DOG_API_FIELDS + ['distance'], row)) for row in rows]}
+
+@app.route('/similar')
+def similar_dogs():
+    name = request.args.get('name', '')
+    results = get_similar_dogs(name)
+    if not results:
+        return render_template('ohno.html') # not cached, so unknown names can't fill the cache
+    return cached_response(['similar', name], lambda: render_template('doggos.html', results=results,
+        headers=DOG_HEADERS, title=f'Breeds like the {name}'))
 
 @app.route('/groupings')
 def groupings():
     return render_template('groupings.html')
 
-@app.route('/doggos', methods=['POST'])
-def doggos():
-    sort_by = request.form['sort']
-    sort_order = request.form['dir']
-    region = request.form['region']
-    size = request.form['size']
-    breed_group = request.form['breed_group']
-    bark = request.form['barkiness']
-    limit = request.form['limit']
-    results = get_dog_results_sql(sort_by, sort_order, region, size, breed_group, bark, limit)
-    headers = ['Dog Breed', 'Rank', 'Origin', 'Breed Group', 'Size', 'Barkiness', 'Min Life Span', 'Max Life Span']
-
-    plot_results = request.form.get('plot', False)
+RESPONSE_CACHE_BYTES = int(os.environ.get('DOG_RESPONSE_CACHE_BYTES', 32 * 1024 * 1024))
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_BYTES, os.environ.get('DOG_RESPONSE_CACHE'))
+RESPONSE_CACHE_VERSION = None
+
+def response_cache_stat(stat):
+    return RESPONSE_CACHE.stats()[stat]
+
+METRICS.add(Gauge('dog_response_cache_hits_total', 'Pages served from the response cache.',
+    functools.partial(response_cache_stat, 'hits'), 'counter'))
+METRICS.add(Gauge('dog_response_cache_misses_total', 'Pages rendered because they were not cached.',
+    functools.partial(response_cache_stat, 'misses'), 'counter'))
+METRICS.add(Gauge('dog_response_cache_evictions_total', 'Pages evicted to keep the cache under its cap.',
+    functools.partial(response_cache_stat, 'evictions'), 'counter'))
+METRICS.add(Gauge('dog_response_cache_entries', 'Pages in the response cache.',
+    functools.partial(response_cache_stat, 'entries')))
+METRICS.add(Gauge('dog_response_cache_bytes', 'Bytes of pages in the response cache.',
+    functools.partial(response_cache_stat, 'bytes')))
+METRICS.add(Gauge('dog_response_cache_disk_evictions_total', 'Pages evicted from the shared cache file.',
+    functools.partial(response_cache_stat, 'disk_evictions'), 'counter'))
+METRICS.add(Gauge('dog_response_cache_disk_bytes', 'Bytes of pages in the shared cache file.',
+    functools.partial(response_cache_stat, 'disk_bytes')))
+
+def cached_response(key, render):
+    '''Answers a request from the response cache, rendering the page
+    only on a miss. The key includes the catalog version, so pages are
+    rendered again after the catalog changes. Browsers that send the
+    page's ETag back get a 304.
+    
+    Parameters
+    ----------
+    key: list
+        The route and its normalized form values.
+    render: callable
+        Renders the page. May raise ValueError for a bad form value.
+    
+    Returns
+    -------
+    flask.Response
+        The page, or an empty 304 response.
+    '''
+    global RESPONSE_CACHE_VERSION
+    version = catalog_version()
+    if version != RESPONSE_CACHE_VERSION:
+        if RESPONSE_CACHE_VERSION is not None:
+            RESPONSE_CACHE.clear(keep_version=version)
+        RESPONSE_CACHE_VERSION = version
+    key = json.dumps([version] + key)
+    entry = RESPONSE_CACHE.get(key)
+    if entry is None:
+        try:
+            body = render()
+        except ValueError:
+            abort(400)
+        entry = RESPONSE_CACHE.put(key, body.encode('utf-8'), version)
+    etag, body = entry
+    if request.if_none_match.contains(etag.strip('"')):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+    response.set_etag(etag.strip('"'))
+    response.cache_control.no_cache = True
+    return response
+
+def known_filters(filters):
+    '''Tells if every filter that is set has a value in the catalog.
+    
+    Parameters
+    ----------
+    filters: dict
+        Form field as the key and the form value as the value,
+        for the fields in DOG_FILTERS.
+    
+    Returns
+    -------
+    bool
+        False if a filter has a value no dog has.
+    '''
+    facets = get_facets()
+    for field, column, everything in DOG_FILTERS:
+        value = filters.get(field, everything)
+        if value != everything and not any(value == known for known, count in facets[field]):
+            return False
+    return True
+
+DOG_HEADERS = ['Dog Breed', 'Rank', 'Origin', 'Breed Group', 'Size', 'Barkiness', 'Min Life Span',
+    'Max Life Span']
+
+def render_doggos(sort_by, sort_order, region, size, breed_group, bark, limit, plot_results):
+    '''Renders the results of a dog search.
+    
+    Parameters
+    ----------
+    Same as get_dog_results_sql, and plot_results: bool
+        Whether to plot the results instead of listing them.
+    
+    Returns
+    -------
+    string
+        The page.
+    '''
+    results = search_dogs(sort_by, sort_order, region, size, breed_group, bark, limit)
+    headers = DOG_HEADERS
+
     if (plot_results):
         x_vals = [r[0] for r in results]
         if sort_by == 'rank':
@@ -728,59 +2862,245 @@ def doggos():
             y_vals = [r[6] for r in results]
         else:
             y_vals = [r[7] for r in results]
-        bars_data = go.Bar(
-            x=x_vals,
-            y=y_vals
-        )
-        fig = go.Figure(data=bars_data)
-        div = fig.to_html(full_html=False)
-        return render_template("plot.html", plot_div=div)
+        return render_plot(x_vals, y_vals)
     elif len(results) == 0:
         return render_template('ohno.html')
     else:
-        return render_template('doggos.html', results=results, headers=headers, doggydict=doggydict)
+        filters = {'region': region, 'size': size, 'breed_group': breed_group, 'barkiness': bark}
+        exports = {fmt: url_for('export_dogs', fmt=fmt, sort=sort_by, dir=sort_order, **filters)
+            for fmt in EXPORT_FORMATS}
+        return render_template('doggos.html', results=results, headers=headers, exports=exports)
 
-@app.route('/results', methods=['POST'])
-def group_results():
-    group_by = request.form['group']
-    sort_order = request.form['dir']
-    sort_by = request.form['sort']
-    results = get_group_results_sql(group_by, sort_order, sort_by)
+@app.route('/doggos', methods=['GET', 'POST'])
+def doggos():
+    sort_by = request.values['sort']
+    sort_order = request.values['dir']
+    region = request.values['region']
+    size = request.values['size']
+    breed_group = request.values['breed_group']
+    bark = request.values['barkiness']
+    limit = request.values.get('limit', '')
+    plot_results = bool(request.values.get('plot', False))
+    try:
+        limit = parse_limit(limit)
+    except ValueError:
+        abort(400)
+    filters = {'region': region, 'size': size, 'breed_group': breed_group, 'barkiness': bark}
+    render = lambda: render_doggos(sort_by, sort_order, region, size, breed_group, bark, limit, plot_results)
+    if not known_filters(filters):
+        # nothing matches, and caching it would let any string fill the cache
+        try:
+            return render()
+        except ValueError:
+            abort(400)
+    # limits past the size of the catalog all give the same page
+    dogs = sum(count for value, count in get_facets()['size'])
+    key = ['doggos', sort_by, sort_order, region, size, breed_group, bark, min(limit, dogs), plot_results]
+    return cached_response(key, render)
+
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+EXPORT_BATCH = 1000         # rows fetched from the cursor and written per chunk
+
+def export_rows(rows, fmt):
+    '''Formats a batch of dog rows for an export.
+    
+    Parameters
+    ----------
+    rows: list
+        Rows from build_dog_query.
+    fmt: string
+        'csv' or 'ndjson'.
+    
+    Returns
+    -------
+    string
+        The formatted rows.
+    '''
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(dict(zip(DOG_API_FIELDS, row))) + '\n' for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+def stream_dogs(query, params, fmt, compress):
+    '''Streams the results of a dog search straight from the database
+    cursor, EXPORT_BATCH rows at a time, so memory use doesn't grow
+    with the number of rows. The CSV header goes out before the query
+    runs.
+    
+    Parameters
+    ----------
+    query: string
+        Query made by build_dog_query.
+    params: list
+        Values to bind to the query.
+    fmt: string
+        'csv' or 'ndjson'.
+    compress: bool
+        Whether to gzip the stream.
+    
+    Returns
+    -------
+    generator
+        Chunks of the export as bytes.
+    '''
+    gzipper = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    def encode(text, flush=False):
+        data = text.encode('utf-8')
+        if gzipper is None:
+            return data
+        data = gzipper.compress(data)
+        return data + gzipper.flush(zlib.Z_SYNC_FLUSH if flush else zlib.Z_NO_FLUSH)
+    if fmt == 'csv':
+        yield encode(export_rows([DOG_API_FIELDS], fmt), flush=True)
+    with read_connection() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            chunk = encode(export_rows(rows, fmt))
+            if chunk:
+                yield chunk
+    if gzipper is not None:
+        yield gzipper.flush()
+
+@app.route('/export/dogs.<fmt>')
+def export_dogs(fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    filters = {field: request.args.get(field, everything)
+        for field, column, everything in DOG_FILTERS}
+    try:
+        query, params = build_dog_query(request.args.get('sort', 'rank'),
+            request.args.get('dir', 'asc'), filters, None)
+    except ValueError as e:
+        abort(400, str(e))
+    compress = bool(request.accept_encodings['gzip'])
+    response = Response(stream_dogs(query, params, fmt, compress), mimetype=EXPORT_FORMATS[fmt])
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Content-Disposition'] = f'attachment; filename=dogs.{fmt}'
+    return response
+
+def render_group_results(group_by, sort_order, sort_by, then_by, plot_results):
+    '''Renders the results of a grouping search.
+    
+    Parameters
+    ----------
+    Same as get_group_results_sql, and plot_results: bool
+        Whether to plot the results instead of listing them.
+    
+    Returns
+    -------
+    string
+        The page.
+    '''
+    results = get_group_results_sql(group_by, sort_order, sort_by, then_by)
     headers = [f'{group_by}'.capitalize(), 'Number of Dogs', 'AKC Rank', 'Min Life Span', 'Max Life Span']
+    labels = 1
+    if then_by:
+        headers.insert(1, then_by.capitalize())
+        labels = 2
 
-    plot_results = request.form.get('plot', False)
     if (plot_results):
-        x_vals = [r[0] for r in results]
+        x_vals = [' / '.join(str(v) for v in r[:labels]) for r in results]
         if sort_by == 'rank':
-            y_vals = [r[2] for r in results]
+            y_vals = [r[labels + 1] for r in results]
         elif sort_by == 'number':
-            y_vals = [r[1] for r in results]
+            y_vals = [r[labels] for r in results]
         elif sort_by == 'min_life':
-            y_vals = [r[3] for r in results]
+            y_vals = [r[labels + 2] for r in results]
         else:
-            y_vals = [r[4] for r in results]
-        bars_data = go.Bar(
-            x=x_vals,
-            y=y_vals
-        )
-        fig = go.Figure(data=bars_data)
-        div = fig.to_html(full_html=False)
-        return render_template("plot.html", plot_div=div)
+            y_vals = [r[labels + 3] for r in results]
+        return render_plot(x_vals, y_vals)
     else:
         return render_template('results.html', results=results, headers=headers)
 
+@app.route('/results', methods=['GET', 'POST'])
+def group_results():
+    group_by = request.values['group']
+    sort_order = request.values['dir']
+    sort_by = request.values['sort']
+    then_by = request.values.get('then', 'none')
+    if then_by == 'none' or then_by == group_by:
+        then_by = None
+    plot_results = bool(request.values.get('plot', False))
+    key = ['results', group_by, sort_order, sort_by, then_by, plot_results]
+    return cached_response(key, lambda: render_group_results(group_by, sort_order, sort_by,
+        then_by, plot_results))
+
+
+INHERITED_CONNECTIONS = []      # pooled connections a worker got from its parent, never used
+
+def reset_after_fork():
+    '''Gives a forked worker its own database connections and locks.
+    Runs in the child after every fork. Connections pooled in the parent
+    are kept alive but never used, since SQLite connections can't be
+    shared across a fork.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    None
+    '''
+    global READ_POOL, FACET_LOCK, COLUMNAR_LOCK, SESSION, HOST_LIMITER
+    while True:
+        try:
+            INHERITED_CONNECTIONS.append(READ_POOL.get_nowait())
+        except queue.Empty:
+            break
+    READ_POOL = queue.LifoQueue()
+    FACET_LOCK = threading.Lock()
+    COLUMNAR_LOCK = threading.Lock()
+    SESSION = None
+    HOST_LIMITER = HostRateLimiter(CRAWL_HOST_INTERVAL)
+    RESPONSE_CACHE.reopen()
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+def create_app():
+    '''Loads the catalog state every request reads and returns the app.
+    Under a pre-fork server, call it in the master (gunicorn's
+    preload_app) so the catalog version, the facets, the columnar
+    catalog with its facet bitmaps and the plotly.js assets are
+    loaded once and every worker shares them copy-on-write. The
+    master's connections are closed before the workers fork, and
+    each worker opens its own.
+    
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    flask.Flask
+        The app.
+    '''
+    if not follow_snapshot() and not os.path.exists(DB_NAME):
+        raise RuntimeError("No dogs to show yet. Fetch some with python build_catalog.py")
+    catalog_version()
+    get_facets()
+    # /api/facets counts with the bitmaps of the columnar catalog
+    # whichever engine runs the searches
+    if importlib.util.find_spec('numpy') is not None:
+        get_columnar_catalog()
+    if importlib.util.find_spec('plotly') is not None:
+        get_plotly_js()
+    close_read_connections()
+    # keeps the garbage collector in the workers from writing to, and so
+    # copying, the pages of everything loaded so far
+    gc.freeze()
+    return app
 
 if __name__ == '__main__':
-    CACHE_DICT = load_cache()
-    print("Creating database of dogs...\nPlease sit for your treat...")
-    create_db()
-    doggydict = get_dogs()
-    doggylist = get_dog_info(doggydict)
-    more_list = get_more_info(doggydict)
-    combined_info = combine_dog_lists(doggylist, more_list)
-    countries = populate_countries(combined_info)
-    country_table(countries)
-    groups = populate_breed_groups(combined_info)
-    group_table(groups)
-    add_info(combined_info) 
-    app.run(debug=True)
\ No newline at end of file
+    try:
+        create_app()
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    app.run(debug=True)
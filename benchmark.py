@@ -0,0 +1,405 @@
+'''Benchmarks for the dog app. Results are printed as JSON so runs
+can be saved and compared. Run with
+
+    python benchmark.py queries [sizes...]
+    python benchmark.py engines [sizes...]
+    python benchmark.py record corpus_dir [number of dogs]
+    python benchmark.py scrape [corpus_dir]
+    python benchmark.py compare old.json new.json [slowdown ratio]
+
+record saves the A-Z list and breed pages of the page cache to
+corpus_dir, or makes a synthetic site of that many dogs, so scrape can
+time the scraper without a network.
+'''
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import app
+import checks
+import synthetic
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+DEFAULT_LIMITS = (app.DEFAULT_LIMIT, 1000)
+CORPUS_MANIFEST = 'corpus.json'
+CORPUS_DOGS = 200           # breeds in the synthetic corpus scrape makes by default
+
+# a result is slower if its median grows by more than the ratio and by
+# more than MIN_SLOWDOWN_MS, since tiny timings are mostly noise
+SLOWDOWN_RATIO = 1.25
+MIN_SLOWDOWN_MS = 0.05
+# fields that say which measurement a result is, not how long it took
+RESULT_KEYS = ['benchmark', 'engine', 'function', 'stage', 'dogs', 'pages', 'limit']
+
+def summarize(times):
+    '''Sums up a list of call times.
+
+    Parameters
+    ----------
+    times: list
+        Call times in milliseconds.
+
+    Returns
+    -------
+    dict
+        Number of calls and the median, 95th percentile and maximum
+        call time in milliseconds.
+    '''
+    times = sorted(times)
+    return {
+        'calls': len(times),
+        'median_ms': round(statistics.median(times), 4),
+        'p95_ms': round(times[int(len(times) * 0.95) - 1 if len(times) > 1 else 0], 4),
+        'max_ms': round(times[-1], 4),
+    }
+
+def time_calls(function, calls, repeat=3):
+    '''Times a function over a list of argument tuples.
+
+    Parameters
+    ----------
+    function: callable
+        The function to time.
+    calls: list
+        Argument tuples, one per call.
+    repeat: int
+        Number of times every call is made. The fastest one counts.
+
+    Returns
+    -------
+    dict
+        Median, 95th percentile and maximum call time in milliseconds.
+    '''
+    times = []
+    for args in calls:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best * 1000)
+    return summarize(times)
+
+def synthetic_catalogs(sizes, directory):
+    '''Builds a synthetic catalog of every size in turn and points the
+    app at it.
+
+    Parameters
+    ----------
+    sizes: list
+        Catalog sizes to build.
+    directory: string
+        Directory the catalogs are written to.
+
+    Returns
+    -------
+    generator
+        The size of the catalog the app is pointed at.
+    '''
+    for n_dogs in sizes:
+        with redirect_stdout(io.StringIO()):
+            synthetic.build_catalog(os.path.join(directory, f'dogs-{n_dogs}.sqlite'), n_dogs)
+        yield n_dogs
+        app.close_read_connections()
+
+def cold_facets():
+    '''Computes the facets again, as the first request after a new
+    catalog does.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict
+        The facets.
+    '''
+    app.FACETS = (None, None)
+    return app.get_facets()
+
+def bench_queries(sizes=DEFAULT_SIZES, limits=DEFAULT_LIMITS):
+    '''Times the dog search, the grouping search and the facet helpers
+    on synthetic catalogs for every combination the forms can send.
+
+    Parameters
+    ----------
+    sizes: list
+        Catalog sizes to time.
+    limits: tuple
+        Row limits to time the dog search with.
+
+    Returns
+    -------
+    list
+        One result dict per size and function.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_dogs in synthetic_catalogs(sizes, tmp):
+            for limit in limits:
+                calls = [
+                    (sort_by, sort_order, filters['region'], filters['size'],
+                        filters['breed_group'], filters['barkiness'], limit)
+                    for sort_by, sort_order, filters, _ in checks.dog_form_combinations()
+                ]
+                found = time_calls(app.get_dog_results_sql, calls)
+                results.append(dict(benchmark='queries', function='get_dog_results_sql',
+                    dogs=n_dogs, limit=limit, **found))
+            found = time_calls(app.get_group_results_sql, checks.group_form_combinations())
+            results.append(dict(benchmark='queries', function='get_group_results_sql',
+                dogs=n_dogs, **found))
+            found = time_calls(cold_facets, [()])
+            results.append(dict(benchmark='queries', function='get_facets', dogs=n_dogs, **found))
+            for helper in [app.get_countries, app.get_sizes, app.get_breedgroups, app.get_barkiness]:
+                found = time_calls(helper, [()])
+                results.append(dict(benchmark='queries', function=helper.__name__, dogs=n_dogs, **found))
+    return results
+
+def bench_engines(sizes=DEFAULT_SIZES, limits=(10, 1000)):
+    '''Times the SQL and columnar search engines on synthetic catalogs
+    for every combination the /dogs form can send.
+
+    Parameters
+    ----------
+    sizes: list
+        Catalog sizes to time.
+    limits: tuple
+        Row limits to time.
+
+    Returns
+    -------
+    list
+        One result dict per size, engine and limit.
+    '''
+    import columnar
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_dogs in synthetic_catalogs(sizes, tmp):
+            start = time.perf_counter()
+            with app.read_connection() as conn:
+                catalog = columnar.ColumnarCatalog.from_db(conn)
+            load_ms = (time.perf_counter() - start) * 1000
+            for limit in limits:
+                combinations = [
+                    (sort_by, sort_order, filters, limit)
+                    for sort_by, sort_order, filters, _ in checks.dog_form_combinations()
+                ]
+                sql_calls = [
+                    (sort_by, sort_order, filters['region'], filters['size'],
+                        filters['breed_group'], filters['barkiness'], limit)
+                    for sort_by, sort_order, filters, limit in combinations
+                ]
+                sql = time_calls(app.get_dog_results_sql, sql_calls)
+                results.append(dict(benchmark='search', engine='sql', dogs=n_dogs, limit=limit, **sql))
+                found = time_calls(catalog.search, combinations)
+                results.append(dict(benchmark='search', engine='columnar', dogs=n_dogs, limit=limit,
+                    load_ms=round(load_ms, 2), bitmap_bytes=catalog.bitmaps.memory_bytes(), **found))
+    return results
+
+def save_corpus(directory, pages, url=app.DOG):
+    '''Writes pages to a corpus directory, one HTML file per page and
+    a manifest that maps URLs to files.
+
+    Parameters
+    ----------
+    directory: string
+        Directory to write the corpus to.
+    pages: dict
+        URL as the key and the page as the value.
+    url: string
+        URL of the A-Z breed list, which must be in pages.
+
+    Returns
+    -------
+    int
+        Number of pages written.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for i, (page_url, page) in enumerate(pages.items()):
+        files[page_url] = f'page-{i}.html'
+        with open(os.path.join(directory, files[page_url]), 'w', encoding='utf-8') as f:
+            f.write(page)
+    with open(os.path.join(directory, CORPUS_MANIFEST), 'w') as f:
+        json.dump({'list_url': url, 'pages': files}, f, indent=1)
+    return len(files)
+
+def load_corpus(directory):
+    '''Reads a corpus written by save_corpus.
+
+    Parameters
+    ----------
+    directory: string
+        Directory of the corpus.
+
+    Returns
+    -------
+    tuple
+        URL of the A-Z breed list, and a dict with the URL as the key
+        and the page as the value.
+    '''
+    with open(os.path.join(directory, CORPUS_MANIFEST)) as f:
+        manifest = json.load(f)
+    pages = {}
+    for page_url, name in manifest['pages'].items():
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            pages[page_url] = f.read()
+    return manifest['list_url'], pages
+
+def cached_pages(url=app.DOG):
+    '''Collects the A-Z breed list and the breed pages that are in the
+    page cache, as the last catalog build fetched them.
+
+    Parameters
+    ----------
+    url: string
+        URL of the A-Z breed list.
+
+    Returns
+    -------
+    dict
+        URL as the key and the page as the value.
+    '''
+    cache = app.load_cache()
+    if cache.get(url) is None:
+        raise SystemExit(f'{url} is not in {app.CACHE_DB_NAME}, build a catalog first')
+    app.CACHE_DICT = cache
+    with redirect_stdout(io.StringIO()):
+        breeds = app.get_dogs(url)
+    pages = {url: cache.get(url)}
+    for page_url in breeds.values():
+        page = cache.get(page_url)
+        if page is not None:
+            pages[page_url] = page
+    cache.close()
+    return pages
+
+def insert_records(records):
+    '''Times add_info loading records into a new in-memory catalog.
+
+    Parameters
+    ----------
+    records: list
+        Records in the format of get_breed_records.
+
+    Returns
+    -------
+    float
+        Time add_info took in seconds.
+    '''
+    conn = sqlite3.connect(':memory:')
+    cur = conn.cursor()
+    app.create_tables(cur)
+    app.drop_indexes(cur)
+    countries = app.populate_countries(records)
+    groups = app.populate_breed_groups(records)
+    app.country_table(cur, countries)
+    app.group_table(cur, groups)
+    start = time.perf_counter()
+    app.add_info(cur, records, countries, groups)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+def bench_scrape(directory=None, repeat=3):
+    '''Times the scraper on a recorded corpus: reading the A-Z list
+    with get_dogs, parsing every breed page with get_breed_records and
+    inserting the records with add_info. Pages are served from the
+    corpus instead of the network.
+
+    Parameters
+    ----------
+    directory: string
+        Directory of a corpus written by save_corpus, or None to time
+        a synthetic corpus of CORPUS_DOGS breeds.
+    repeat: int
+        Number of times every stage runs. The fastest run counts.
+
+    Returns
+    -------
+    list
+        One result dict per stage.
+    '''
+    if directory is None:
+        url, pages = app.DOG, synthetic.make_site(CORPUS_DOGS)
+    else:
+        url, pages = load_corpus(directory)
+    app.CACHE_DICT = pages
+    with redirect_stdout(io.StringIO()): # a stick per page
+        breeds = app.get_dogs(url)
+        records = app.get_breed_records(breeds)
+        stages = [
+            ('get_dogs', time_calls(app.get_dogs, [(url,)], repeat)),
+            ('get_breed_records', time_calls(app.get_breed_records, [(breeds,)], repeat)),
+        ]
+    add_ms = [insert_records(records) * 1000 for _ in range(repeat)]
+    stages.append(('add_info', summarize([min(add_ms)])))
+    info = dict(benchmark='scrape', pages=len(pages), dogs=len(records),
+        page_bytes=sum(len(page) for page in pages.values()))
+    return [dict(info, stage=stage, **found) for stage, found in stages]
+
+def compare_results(old, new, ratio=SLOWDOWN_RATIO):
+    '''Finds the results that got slower between two runs.
+
+    Parameters
+    ----------
+    old: list
+        Results of the earlier run.
+    new: list
+        Results of the later run.
+    ratio: float
+        Slowdown of the median a result may have.
+
+    Returns
+    -------
+    list
+        (result key, old median, new median) for every result that got
+        slower.
+    '''
+    def key(result):
+        return tuple((field, result[field]) for field in RESULT_KEYS if field in result)
+    before = {key(result): result['median_ms'] for result in old}
+    slower = []
+    for result in new:
+        old_ms = before.get(key(result))
+        new_ms = result['median_ms']
+        if old_ms is not None and new_ms > old_ms * ratio and new_ms - old_ms > MIN_SLOWDOWN_MS:
+            slower.append((dict(key(result)), old_ms, new_ms))
+    return slower
+
+if __name__ == '__main__':
+    suite = sys.argv[1] if len(sys.argv) > 1 else 'engines'
+    if suite in ('queries', 'engines'):
+        sizes = [int(size) for size in sys.argv[2:]] or DEFAULT_SIZES
+        bench = bench_queries if suite == 'queries' else bench_engines
+        print(json.dumps(bench(sizes), indent=2))
+    elif suite == 'record':
+        if len(sys.argv) > 3:
+            pages = synthetic.make_site(int(sys.argv[3]))
+        else:
+            pages = cached_pages()
+        print(f'Saved {save_corpus(sys.argv[2], pages)} pages to {sys.argv[2]}')
+    elif suite == 'scrape':
+        print(json.dumps(bench_scrape(sys.argv[2] if len(sys.argv) > 2 else None), indent=2))
+    elif suite == 'compare':
+        with open(sys.argv[2]) as f:
+            old = json.load(f)
+        with open(sys.argv[3]) as f:
+            new = json.load(f)
+        ratio = float(sys.argv[4]) if len(sys.argv) > 4 else SLOWDOWN_RATIO
+        slower = compare_results(old, new, ratio)
+        for result, old_ms, new_ms in slower:
+            print(f'{result}: {old_ms} ms -> {new_ms} ms')
+        print(f'{len(slower)} benchmarks got slower')
+        sys.exit(1 if slower else 0)
+    else:
+        print(f'Unknown benchmark {suite}')
+        sys.exit(2)
@@ -0,0 +1,205 @@
+'''Builds the dog catalog offline. Every build is written to a new
+snapshot file in app.CATALOG_DIR and published by pointing
+app.CATALOG_POINTER at it, so the web app never waits for a crawl and
+picks up new catalogs without a restart. Run with
+
+    python build_catalog.py [--full] [--workers N]
+'''
+import itertools
+import os
+import sqlite3
+import sys
+import time
+
+import app
+
+SNAPSHOTS_KEPT = 3      # published snapshots kept on disk, the current one included
+
+def copy_database(source, target):
+    '''Copies a SQLite database with the backup API, so the copy is
+    consistent even while the source is being read.
+
+    Parameters
+    ----------
+    source: string
+        Path of the database to copy.
+    target: string
+        Path of the copy.
+
+    Returns
+    -------
+    None
+    '''
+    src = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+def schema_version(path):
+    '''Returns the schema version of a database, which SQLite changes
+    every time a table or index is created or dropped.
+
+    Parameters
+    ----------
+    path: string
+        Path of the database.
+
+    Returns
+    -------
+    int
+        The schema version.
+    '''
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA schema_version').fetchone()[0]
+    finally:
+        conn.close()
+
+def finish_snapshot(path):
+    '''Turns a freshly built database into a single compact file that
+    readers can open as immutable.
+
+    Parameters
+    ----------
+    path: string
+        Path of the database.
+
+    Returns
+    -------
+    None
+    '''
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+def publish_snapshot(path):
+    '''Moves a finished database into the catalog directory and points
+    app.CATALOG_POINTER at it. Both steps are renames, so readers see
+    either the old snapshot or the new one, never half of one.
+
+    Parameters
+    ----------
+    path: string
+        Path of the finished database, in app.CATALOG_DIR.
+
+    Returns
+    -------
+    string
+        Path of the published snapshot.
+    '''
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    for attempt in itertools.count():
+        name = f'doginfo-{stamp}-{attempt}.sqlite'
+        snapshot = os.path.join(app.CATALOG_DIR, name)
+        if not os.path.exists(snapshot):
+            break
+    os.replace(path, snapshot)
+    pointer = app.CATALOG_POINTER + '.tmp'
+    with open(pointer, 'w') as f:
+        f.write(name + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, app.CATALOG_POINTER)
+    return snapshot
+
+def prune_snapshots(keep=SNAPSHOTS_KEPT):
+    '''Deletes all but the newest published snapshots. Servers still
+    reading a deleted snapshot keep their open file until they switch.
+
+    Parameters
+    ----------
+    keep: int
+        Number of snapshots to keep.
+
+    Returns
+    -------
+    list
+        Paths of the deleted snapshots.
+    '''
+    current = app.current_snapshot()
+    snapshots = sorted(
+        (entry.path for entry in os.scandir(app.CATALOG_DIR)
+            if entry.name.startswith('doginfo-') and entry.name.endswith('.sqlite')),
+        key=os.path.getmtime, reverse=True)
+    deleted = []
+    for path in snapshots[keep:]:
+        if path != current:
+            os.remove(path)
+            deleted.append(path)
+    return deleted
+
+def build(full=False, workers=app.CRAWL_WORKERS, url=app.DOG):
+    '''Crawls the breed pages and publishes a new snapshot. Unless full
+    is set, the new snapshot starts as a copy of the current one and
+    only the breeds whose pages changed are parsed again.
+
+    Parameters
+    ----------
+    full: bool
+        Build the catalog from scratch.
+    workers: int
+        Number of breed pages fetched in parallel.
+    url: string
+        Page that lists every breed.
+
+    Returns
+    -------
+    string
+        Path of the published snapshot, or None if nothing changed.
+    '''
+    os.makedirs(app.CATALOG_DIR, exist_ok=True)
+    cache = app.load_cache()
+    app.CACHE_DICT = cache
+    doggydict = app.get_dogs(url)
+    if workers > 1:
+        failed = app.crawl_breed_pages(doggydict.values(), cache, workers=workers)
+        for page, error in failed.items():
+            print(f"Lost the stick for {page}: {error}")
+    current = published = app.current_snapshot()
+    if current is None and os.path.exists(app.DB_NAME):
+        current = app.DB_NAME # catalog built before snapshots
+    building = os.path.join(app.CATALOG_DIR, f'.building-{os.getpid()}.sqlite')
+    try:
+        if full or current is None:
+            print("Creating database of dogs...\nPlease sit for your treat...")
+            app.use_database(building)
+            app.create_db()
+            app.load_catalog(app.get_breed_records(doggydict))
+            app.record_page_hashes(doggydict, cache)
+        else:
+            print("Updating database of dogs...")
+            copy_database(current, building)
+            schema = schema_version(building)
+            app.use_database(building)
+            changed, removed = app.refresh_catalog(doggydict, cache)
+            print(f"{changed} breeds changed, {removed} breeds removed")
+            # a new table or index is published even if no breed changed
+            if (not changed and not removed and published is not None
+                    and schema_version(building) == schema):
+                return None
+        app.close_read_connections()
+        finish_snapshot(building)
+        snapshot = publish_snapshot(building)
+    finally:
+        app.close_read_connections()
+        for suffix in ['', '-wal', '-shm', '-journal']:
+            if os.path.exists(building + suffix):
+                os.remove(building + suffix)
+    prune_snapshots()
+    return snapshot
+
+if __name__ == '__main__':
+    workers = app.CRAWL_WORKERS
+    if '--workers' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1])
+    snapshot = build(full='--full' in sys.argv, workers=workers)
+    if snapshot is None:
+        print("No new tricks, the current catalog is up to date")
+    else:
+        print(f"Good dog! Published {snapshot}")
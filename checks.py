@@ -0,0 +1,253 @@
+'''Checks that guard the app's performance. Run with
+
+    python checks.py plans [number of dogs]
+    python checks.py columnar [number of dogs]
+    python checks.py imports [budget in ms]
+
+Exits with status 1 if a check fails.
+'''
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+
+import app
+import synthetic
+
+DOG_SORTS = ['rank', 'max_life', 'min_life']
+GROUP_SORTS = ['rank', 'max_life', 'min_life', 'number']
+DIRECTIONS = ['desc', 'asc']
+GROUP_BYS = ['breed group', 'origin', 'size', 'barkiness']
+
+CURSORS = [None, (5, 500), (None, 500)]  # (sort value, Id) pages start after
+
+# time importing app may add on top of importing flask, best of IMPORT_RUNS.
+# flask itself is left out since it varies a lot between machines
+IMPORT_BUDGET_MS = 60
+IMPORT_RUNS = 5
+# only the crawler, the columnar engine and plotly.js assets need these
+LAZY_MODULES = ['requests', 'bs4', 'lxml', 'plotly', 'numpy', 'brotli', 'columnar']
+
+def dog_form_combinations():
+    '''Lists every combination of sort and filters the /dogs form
+    can send. Each filter is either off or set to a value that is
+    in the catalog.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list
+        Argument tuples for build_dog_query.
+    '''
+    regions = ['All', app.get_countries()[0]]
+    sizes = ['All', app.get_sizes()[0]]
+    groups = ['All', app.get_breedgroups()[0]]
+    barks = ['All bark levels', app.get_barkiness()[0]]
+    return [
+        (sort_by, sort_order, {'region': region, 'size': size, 'breed_group': group,
+            'barkiness': bark}, 10)
+        for sort_by, sort_order, region, size, group, bark
+        in itertools.product(DOG_SORTS, DIRECTIONS, regions, sizes, groups, barks)
+    ]
+
+def group_form_combinations():
+    '''Lists every combination the /groupings form can send.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list
+        Argument tuples for get_group_results_sql.
+    '''
+    return [
+        (group_by, sort_order, sort_by, then_by)
+        for group_by, sort_order, sort_by, then_by
+        in itertools.product(GROUP_BYS, DIRECTIONS, GROUP_SORTS, [None] + GROUP_BYS)
+    ]
+
+def query_plan(query, params=()):
+    '''Runs EXPLAIN QUERY PLAN for a query.
+
+    Parameters
+    ----------
+    query: string
+        The query.
+    params: sequence
+        Values bound to the query.
+
+    Returns
+    -------
+    list
+        The detail column of every step of the plan.
+    '''
+    with app.read_connection() as conn:
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()
+    return [row[3] for row in rows]
+
+def is_full_scan(step):
+    return step.startswith('SCAN ') and 'INDEX' not in step
+
+def check_query_plans(n_dogs=100000):
+    '''Builds a synthetic catalog and checks the plan of every query
+    the forms and the JSON APIs can produce. Dog searches and API
+    pages must not scan a table or sort in a temp B-tree, and
+    groupings must not scan a table or group in a temp B-tree.
+
+    Parameters
+    ----------
+    n_dogs: int
+        Number of dogs in the synthetic catalog.
+
+    Returns
+    -------
+    list
+        (arguments, plan) for every query that failed the check.
+    '''
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic.build_catalog(os.path.join(tmp, 'plans.sqlite'), n_dogs)
+        for args in dog_form_combinations():
+            plan = query_plan(*app.build_dog_query(*args))
+            if any(is_full_scan(step) or 'TEMP B-TREE' in step for step in plan):
+                failures.append((args, plan))
+        for args in group_form_combinations():
+            plan = query_plan(*app.group_results_query(*args))
+            if any(is_full_scan(step) or 'TEMP B-TREE FOR GROUP BY' in step for step in plan):
+                failures.append((args, plan))
+        # pages of the JSON APIs, first ones and ones after a cursor
+        pages = [(app.build_dog_page_query, (sort_by, sort_order, filters, after))
+            for sort_by, sort_order, filters, _ in dog_form_combinations() for after in CURSORS]
+        pages += [(app.build_group_page_query, args + (after,))
+            for args in group_form_combinations() for after in CURSORS]
+        for build, args in pages:
+            for query, params in build(*args):
+                plan = query_plan(query, params + [app.API_PAGE_SIZE + 1])
+                if any(is_full_scan(step) or 'TEMP B-TREE' in step for step in plan):
+                    failures.append((args, plan))
+        app.close_read_connections()
+    return failures
+
+def check_columnar_parity(n_dogs=20000):
+    '''Builds a synthetic catalog and checks that the columnar engine
+    returns exactly the rows get_dog_results_sql returns, for every
+    combination the /dogs form can send and a range of limits.
+
+    Parameters
+    ----------
+    n_dogs: int
+        Number of dogs in the synthetic catalog.
+
+    Returns
+    -------
+    list
+        (arguments, SQL rows, columnar rows) for every search that
+        didn't match.
+    '''
+    import columnar
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic.build_catalog(os.path.join(tmp, 'parity.sqlite'), n_dogs)
+        with app.read_connection() as conn:
+            catalog = columnar.ColumnarCatalog.from_db(conn)
+        combinations = dog_form_combinations()
+        combinations.append(('rank', 'asc', {'region': 'Atlantis'}, 10))
+        for sort_by, sort_order, filters, limit in combinations:
+            for limit in [1, 10, 1000, n_dogs + 1]:
+                args = (sort_by, sort_order, filters.get('region', 'All'),
+                    filters.get('size', 'All'), filters.get('breed_group', 'All'),
+                    filters.get('barkiness', 'All bark levels'), limit)
+                expected = app.get_dog_results_sql(*args)
+                found = catalog.search(sort_by, sort_order, filters, limit)
+                if found != expected:
+                    failures.append((args, expected, found))
+        app.close_read_connections()
+    return failures
+
+def import_times(module='app'):
+    '''Imports a module in a fresh interpreter with -X importtime.
+
+    Parameters
+    ----------
+    module: string
+        The module to import.
+
+    Returns
+    -------
+    dict
+        Every module that was imported as the key and its cumulative
+        import time in milliseconds as the value.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+def check_import_time(budget_ms=IMPORT_BUDGET_MS, runs=IMPORT_RUNS):
+    '''Checks that importing app adds no more than a time budget to
+    importing flask and doesn't load any of LAZY_MODULES. Each run uses
+    a new interpreter, and the fastest run counts.
+
+    Parameters
+    ----------
+    budget_ms: float
+        Longest the import may take in milliseconds, not counting flask.
+    runs: int
+        Number of times app is imported.
+
+    Returns
+    -------
+    list
+        A message for every check that failed.
+    '''
+    best, times = None, {}
+    for _ in range(runs):
+        times = import_times('app')
+        own = times['app'] - times.get('flask', 0)
+        best = own if best is None else min(best, own)
+    failures = [f'app imports {name} ({times[name]:.1f} ms)'
+        for name in LAZY_MODULES if name in times]
+    if best > budget_ms:
+        failures.append(f'importing app took {best:.1f} ms, the budget is {budget_ms} ms')
+    print(f'importing app took {best:.1f} ms on top of flask')
+    return failures
+
+if __name__ == '__main__':
+    check = sys.argv[1] if len(sys.argv) > 1 else 'plans'
+    if check == 'plans':
+        n_dogs = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        failures = check_query_plans(n_dogs)
+        for args, plan in failures:
+            print(args)
+            for step in plan:
+                print('    ' + step)
+        print(f'{len(failures)} query plans regressed')
+        sys.exit(1 if failures else 0)
+    if check == 'columnar':
+        n_dogs = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+        failures = check_columnar_parity(n_dogs)
+        for args, expected, found in failures:
+            print(args)
+            print(f'    sql:      {expected[:3]}')
+            print(f'    columnar: {found[:3]}')
+        print(f'{len(failures)} columnar searches differ from SQL')
+        sys.exit(1 if failures else 0)
+    if check == 'imports':
+        budget_ms = float(sys.argv[2]) if len(sys.argv) > 2 else IMPORT_BUDGET_MS
+        failures = check_import_time(budget_ms)
+        for failure in failures:
+            print(failure)
+        sys.exit(1 if failures else 0)
+    print(f'Unknown check {check}')
+    sys.exit(2)
@@ -0,0 +1,296 @@
+'''In-memory column store for dog searches. The Dogs table, joined
+with Countries and Groups, is held in NumPy arrays, filters are
+answered from bitmaps and sorts from precomputed positions instead
+of SQL. Needs numpy.
+'''
+import sys
+
+import numpy as np
+
+from forms import DOG_FILTERS, DOG_SORT_COLUMNS, SORT_DIRECTIONS, lookup_choice, parse_limit
+
+# position of each column in the rows returned by get_dog_results_sql
+RESULT_COLUMNS = ['Name', 'Rank', 'Country', 'BreedGroup', 'Size', 'Barkiness',
+    'MinLifespan', 'MaxLifespan', 'Url']
+FILTER_COLUMNS = {'region': 2, 'size': 4, 'breed_group': 3, 'barkiness': 5}
+SORT_COLUMNS = {'rank': 1, 'min_life': 6, 'max_life': 7}
+
+def sqlite_order(values, ids):
+    '''Finds where every row lands when sorted the way SQLite sorts a
+    column: NULLs first, then numbers, then text, with ties broken
+    by Id.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        Object array of the column values.
+    ids: numpy.ndarray
+        The Id of every row.
+
+    Returns
+    -------
+    numpy.ndarray
+        The position of every row in ascending order.
+    '''
+    n = len(values)
+    kind = np.zeros(n, dtype=np.int8)
+    number = np.zeros(n, dtype=np.float64)
+    text = np.zeros(n, dtype=np.int64)
+    is_number = np.fromiter((isinstance(v, (int, float)) for v in values), bool, n)
+    is_text = np.fromiter((isinstance(v, str) for v in values), bool, n)
+    kind[is_number] = 1
+    kind[is_text] = 2
+    number[is_number] = values[is_number].astype(np.float64)
+    if is_text.any():
+        text[is_text] = np.unique(values[is_text], return_inverse=True)[1]
+    order = np.lexsort((ids, text, number, kind))
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    return position
+
+class BitmapIndex:
+    '''One bitset per value of every filter column, stored as a Python
+    int with bit i set when row i has the value. A search with several
+    filters is a bitwise AND of at most one bitmap per filter.
+    '''
+    def __init__(self, size, codes, categories):
+        '''
+        Parameters
+        ----------
+        size: int
+            Number of rows.
+        codes: dict
+            Form field as the key and the array of categorical codes
+            of its column as the value.
+        categories: dict
+            Form field as the key and a dict of value to code as the value.
+        '''
+        self.size = size
+        self.everything = (1 << size) - 1
+        self.bitmaps = {}
+        for field, values in categories.items():
+            self.bitmaps[field] = {
+                value: int.from_bytes(
+                    np.packbits(codes[field] == code, bitorder='little').tobytes(), 'little')
+                for value, code in values.items()
+            }
+
+    def match(self, filters, skip=None):
+        '''ANDs the bitmaps of the filters that are set.
+
+        Parameters
+        ----------
+        filters: dict
+            Form field as the key and the form value as the value,
+            for the fields in DOG_FILTERS.
+        skip: string
+            A form field to leave out.
+
+        Returns
+        -------
+        int
+            Bitmap of the matching rows, or None when no filter is set.
+        '''
+        bitmap = None
+        for field, column, everything in DOG_FILTERS:
+            value = filters.get(field, everything)
+            if field == skip or value == everything:
+                continue
+            value_bitmap = self.bitmaps[field].get(value, 0)
+            bitmap = value_bitmap if bitmap is None else bitmap & value_bitmap
+        return bitmap
+
+    def rows(self, bitmap):
+        '''Lists the rows set in a bitmap.
+
+        Parameters
+        ----------
+        bitmap: int
+            The bitmap.
+
+        Returns
+        -------
+        numpy.ndarray
+            Row numbers in ascending order.
+        '''
+        raw = np.frombuffer(bitmap.to_bytes((self.size + 7) // 8, 'little'), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(raw, bitorder='little')[:self.size])
+
+    def option_counts(self, filters):
+        '''Counts, for every value of every filter, how many dogs would
+        match if that filter were changed to the value and the other
+        filters stayed as they are.
+
+        Parameters
+        ----------
+        filters: dict
+            Form field as the key and the form value as the value,
+            for the fields in DOG_FILTERS.
+
+        Returns
+        -------
+        dict
+            Form field as the key and a dict of value to number of
+            matching dogs as the value.
+        '''
+        counts = {}
+        for field, bitmaps in self.bitmaps.items():
+            others = self.match(filters, skip=field)
+            if others is None:
+                others = self.everything
+            counts[field] = {value: (bitmap & others).bit_count()
+                for value, bitmap in bitmaps.items()}
+        return counts
+
+    def memory_bytes(self):
+        '''Returns the memory taken by the bitmaps.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Size of all the bitmaps in bytes.
+        '''
+        return sum(sys.getsizeof(bitmap)
+            for bitmaps in self.bitmaps.values() for bitmap in bitmaps.values())
+
+class ColumnarCatalog:
+    '''The dog catalog as column arrays. Filter columns are stored as
+    categorical codes with a bitmap per value, and every sort column
+    as a precomputed sort position, so a search is a few bitwise ANDs
+    and a partial sort.
+    '''
+    def __init__(self, rows):
+        '''
+        Parameters
+        ----------
+        rows: list
+            (Id, Name, Rank, Country, BreedGroup, Size, Barkiness,
+            MinLifespan, MaxLifespan, Url) tuples.
+        '''
+        self.size = len(rows)
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.columns = []
+        for i in range(len(RESULT_COLUMNS)):
+            column = np.empty(self.size, dtype=object)
+            column[:] = [row[i + 1] for row in rows]
+            self.columns.append(column)
+        self.categories = {}
+        self.codes = {}
+        for field, i in FILTER_COLUMNS.items():
+            values = {}
+            codes = np.fromiter((values.setdefault(v, len(values)) for v in self.columns[i]),
+                np.int32, self.size)
+            self.categories[field] = values
+            self.codes[field] = codes
+        self.positions = {
+            sort_by: sqlite_order(self.columns[i], self.ids)
+            for sort_by, i in SORT_COLUMNS.items()
+        }
+        self.bitmaps = BitmapIndex(self.size, self.codes, self.categories)
+
+    @classmethod
+    def from_db(cls, conn):
+        '''Loads the catalog from the dog database.
+
+        Parameters
+        ----------
+        conn: sqlite3.Connection
+            Connection to the dog database.
+
+        Returns
+        -------
+        ColumnarCatalog
+            The loaded catalog.
+        '''
+        query = '''
+        SELECT D.Id, D.Name, D.Rank, C.Country, G.BreedGroup, D.Size, D.Barkiness,
+        D.MinLifespan, D.MaxLifespan, D.Url FROM Dogs AS D
+        JOIN Countries AS C ON D.CountryId=C.Id JOIN Groups AS G ON D.BreedGroupId=G.Id
+        ORDER BY D.Id
+        '''
+        return cls(conn.execute(query).fetchall())
+
+    def match(self, filters):
+        '''Finds the rows that match the filters by ANDing their bitmaps.
+
+        Parameters
+        ----------
+        filters: dict
+            Form field as the key and the form value as the value,
+            for the fields in DOG_FILTERS.
+
+        Returns
+        -------
+        numpy.ndarray
+            Row numbers of the matching dogs, or None when no filter
+            is set.
+        '''
+        bitmap = self.bitmaps.match(filters)
+        return None if bitmap is None else self.bitmaps.rows(bitmap)
+
+    def top(self, rows, sort_by, sort_order, limit):
+        '''Sorts rows and keeps the first limit of them.
+
+        Parameters
+        ----------
+        rows: numpy.ndarray
+            Row numbers to sort, or None for every row.
+        sort_by: string
+            Form value of the sort column.
+        sort_order: string
+            'asc' or 'desc'.
+        limit: int
+            Number of rows to keep.
+
+        Returns
+        -------
+        numpy.ndarray
+            Row numbers in sorted order.
+        '''
+        key = self.positions[sort_by]
+        if rows is not None:
+            key = key[rows]
+        if sort_order == 'desc':
+            key = -key
+        limit = min(limit, len(key))
+        if limit == 0:
+            return np.empty(0, dtype=np.int64)
+        if limit < len(key):
+            best = np.argpartition(key, limit - 1)[:limit]
+            best = best[np.argsort(key[best])]
+        else:
+            best = np.argsort(key)
+        return best if rows is None else rows[best]
+
+    def search(self, sort_by, sort_order, filters, limit):
+        '''Answers a dog search with the same rows, in the same order,
+        as get_dog_results_sql.
+
+        Parameters
+        ----------
+        sort_by: string
+            String representation of html form. Sort by
+            numerical data.
+        sort_order: string
+            String representation of html form. How the user
+            wants to sort data.
+        filters: dict
+            Form field as the key and the form value as the value,
+            for the fields in DOG_FILTERS.
+        limit: string
+            Number of rows that the user requests.
+
+        Returns
+        -------
+        list
+            The matching dogs as tuples.
+        '''
+        lookup_choice(DOG_SORT_COLUMNS, sort_by, 'sort')
+        lookup_choice(SORT_DIRECTIONS, sort_order, 'sort direction')
+        limit = parse_limit(limit)
+        best = self.top(self.match(filters), sort_by, sort_order, limit)
+        return [tuple(column[i] for column in self.columns) for i in best]
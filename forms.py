@@ -0,0 +1,57 @@
+'''The form values the search routes accept, and how they're checked.
+Shared by app and the columnar engine.
+'''
+
+SORT_DIRECTIONS = {'asc': 'ASC', 'desc': 'DESC'}
+DOG_SORT_COLUMNS = {'rank': 'D.Rank', 'max_life': 'D.MaxLifespan', 'min_life': 'D.MinLifespan'}
+# form field, column it filters, and the form value that means no filter.
+# A new filter only needs a line here and a field in dogs.html.
+DOG_FILTERS = [
+    ('region', 'C.Country', 'All'),
+    ('size', 'D.Size', 'All'),
+    ('breed_group', 'G.BreedGroup', 'All'),
+    ('barkiness', 'D.Barkiness', 'All bark levels'),
+]
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 1000        # rows on one results page; the exports have every row
+
+def lookup_choice(choices, value, name):
+    '''Looks up a form value in a whitelist.
+    
+    Parameters
+    ----------
+    choices: dict
+        Allowed form values as keys.
+    value: string
+        The form value.
+    name: string
+        Name of the form field, for the error message.
+    
+    Returns
+    -------
+    The value for the form value in choices.
+    '''
+    if value not in choices:
+        raise ValueError(f'{value!r} is not a valid {name}')
+    return choices[value]
+
+def parse_limit(limit):
+    '''Turns the limit from the form into a number of rows. Limits
+    over MAX_LIMIT are cut down to it.
+    
+    Parameters
+    ----------
+    limit: string
+        The limit from the form. Empty means the default.
+    
+    Returns
+    -------
+    int
+        The number of rows.
+    '''
+    if not limit:
+        return DEFAULT_LIMIT
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    return min(limit, MAX_LIMIT)
@@ -0,0 +1,18 @@
+'''Settings for serving the dog app with gunicorn. Run with
+
+    gunicorn -c gunicorn.conf.py
+
+The app is loaded once in the master (preload_app), so every worker
+shares the catalog state copy-on-write and opens its own database
+connections after the fork. Searches are CPU bound, so there is one
+worker process per core.
+'''
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app()'
+preload_app = True
+bind = os.environ.get('DOG_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('DOG_WORKERS', multiprocessing.cpu_count()))
+# threads only help while a worker waits on slow clients, like exports
+threads = int(os.environ.get('DOG_THREADS', 1))
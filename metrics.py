@@ -0,0 +1,248 @@
+'''Counters and histograms for the app, rendered in the Prometheus text
+format for /metrics. Every process keeps its own numbers, so with
+several server processes each one is scraped on its own.
+'''
+import bisect
+import threading
+
+# seconds, from a cached page to a cold plot of a big catalog
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names, values, extra=()):
+    '''Formats label names and values the way the text format wants them.
+
+    Parameters
+    ----------
+    names: tuple
+        Label names.
+    values: tuple
+        Label values, in the same order.
+    extra: tuple
+        More (name, value) pairs, like the le of a bucket.
+
+    Returns
+    -------
+    string
+        The labels in braces, or an empty string without labels.
+    '''
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def format_value(value):
+    '''Formats a sample value.
+
+    Parameters
+    ----------
+    value: float
+        The value.
+
+    Returns
+    -------
+    string
+        The value, without a trailing .0 for whole numbers.
+    '''
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    '''A number that only goes up, per combination of labels.
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        '''
+        Parameters
+        ----------
+        name: string
+            Name of the metric.
+        help: string
+            What the metric counts.
+        labels: tuple
+            Label names.
+        '''
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        '''Adds to the counter of some labels.
+
+        Parameters
+        ----------
+        amount: float
+            How much to add.
+        labels:
+            A value for every label name.
+
+        Returns
+        -------
+        None
+        '''
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        '''Lists the lines of the metric.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            Sample lines in the text format.
+        '''
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}'
+            for key, value in values]
+
+class Histogram:
+    '''Observations counted in buckets, per combination of labels.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        '''
+        Parameters
+        ----------
+        name: string
+            Name of the metric.
+        help: string
+            What the metric observes.
+        labels: tuple
+            Label names.
+        buckets: tuple
+            Upper bounds of the buckets, smallest first. A +Inf bucket
+            is always added.
+        '''
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}    # labels -> [count per bucket, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        '''Records one observation.
+
+        Parameters
+        ----------
+        value: float
+            The observed value.
+        labels:
+            A value for every label name.
+
+        Returns
+        -------
+        None
+        '''
+        key = tuple(labels[name] for name in self.labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bucket] += 1
+            counts[1] += value
+
+    def samples(self):
+        '''Lists the lines of the metric, with cumulative buckets.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            Sample lines in the text format.
+        '''
+        with self.lock:
+            values = sorted((key, list(counts), total) for key, (counts, total) in self.values.items())
+        lines = []
+        for key, counts, total in values:
+            seen = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                seen += count
+                labels = format_labels(self.labels, key, [('le', format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {seen}')
+            labels = format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(round(total, 9))}')
+            lines.append(f'{self.name}_count{labels} {seen}')
+        return lines
+
+class Gauge:
+    '''A number read from a function whenever the metrics are rendered,
+    for numbers something else already keeps.
+    '''
+    def __init__(self, name, help, read, kind='gauge'):
+        '''
+        Parameters
+        ----------
+        name: string
+            Name of the metric.
+        help: string
+            What the metric measures.
+        read: callable
+            Returns the current value.
+        kind: string
+            'gauge', or 'counter' for a number that only goes up.
+        '''
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        return [f'{self.name} {format_value(self.read())}']
+
+class Registry:
+    '''The metrics rendered together on one page.
+    '''
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        '''Registers a metric.
+
+        Parameters
+        ----------
+        metric: Counter, Histogram or Gauge
+            The metric.
+
+        Returns
+        -------
+        Counter, Histogram or Gauge
+            The same metric.
+        '''
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        '''Renders every metric in the Prometheus text format.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        string
+            The metrics page.
+        '''
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,249 @@
+'''Cache for rendered pages. Entries are kept in memory with least
+recently used eviction under a size cap, and can also be written to a
+SQLite file so several worker processes share them. The file has the
+same size cap, and its oldest pages go first.
+'''
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import threading
+import time
+
+DISK_EVICT_TO = 0.9     # eviction on disk stops at this share of max_bytes
+
+class ResponseCache:
+    '''Rendered pages by key, with an ETag for every page.
+    '''
+    def __init__(self, max_bytes, path=None):
+        '''
+        Parameters
+        ----------
+        max_bytes: int
+            Size cap for the pages kept in memory, and for the pages in
+            the SQLite file.
+        path: string
+            SQLite file shared between processes, or None to only
+            keep pages in memory.
+        '''
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.disk_size = 0      # counts up between evictions, which recount it
+        self.path = path
+        self.conn = None
+        if path is not None:
+            self.conn = self.connect()
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS "Responses" (
+                    "Key"  TEXT PRIMARY KEY,
+                    "ETag" TEXT NOT NULL,
+                    "Body" BLOB NOT NULL,
+                    "CreatedAt" REAL NOT NULL,
+                    "Version" TEXT
+                )
+            ''')
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info("Responses")')]
+            if 'Version' not in columns: # a file from before versions were kept
+                self.conn.execute('ALTER TABLE "Responses" ADD COLUMN "Version" TEXT')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS "ResponsesCreatedAt" ON "Responses" ("CreatedAt")')
+            self.conn.commit()
+            self.disk_size = self.stored_bytes()
+
+    def connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+
+    def stored_bytes(self):
+        return self.conn.execute('SELECT COALESCE(SUM(length(Body)), 0) FROM Responses').fetchone()[0]
+
+    def reopen(self):
+        '''Gives a forked worker its own lock and connection. The pages
+        in memory are kept, since the worker got a copy of them.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.lock = threading.Lock()
+        if self.conn is not None:
+            # SQLite connections can't be used, or even closed, on both
+            # sides of a fork, so the parent's one is only kept alive
+            self.parent_conn = self.conn
+            self.conn = self.connect()
+
+    def get(self, key):
+        '''Looks up a page, in memory first and then on disk.
+
+        Parameters
+        ----------
+        key: string
+            The cache key.
+
+        Returns
+        -------
+        tuple
+            The ETag and the page as bytes, or None on a miss.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if self.conn is not None:
+                row = self.conn.execute('SELECT ETag, Body FROM Responses WHERE Key = ?',
+                    [key]).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    self.remember(key, (row[0], bytes(row[1])))
+                    return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, body, version=None):
+        '''Stores a page.
+
+        Parameters
+        ----------
+        key: string
+            The cache key.
+        body: bytes
+            The page.
+        version: string
+            Version of the data the page was rendered from, so clear
+            can tell which pages on disk are out of date.
+
+        Returns
+        -------
+        tuple
+            The ETag and the page.
+        '''
+        entry = ('"' + hashlib.sha1(body).hexdigest()[:20] + '"', body)
+        with self.lock:
+            self.remember(key, entry)
+            if self.conn is not None and len(body) <= self.max_bytes:
+                with self.conn:
+                    self.conn.execute('INSERT OR REPLACE INTO Responses VALUES (?, ?, ?, ?, ?)',
+                        [key, entry[0], body, time.time(), version])
+                self.disk_size += len(body)
+                if self.disk_size > self.max_bytes:
+                    self.evict_disk()
+        return entry
+
+    def evict_disk(self):
+        '''Deletes the oldest pages in the SQLite file until it is down
+        to DISK_EVICT_TO of max_bytes. Other processes write to the file
+        too, so its size is recounted first. Call with the lock held.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Number of pages deleted.
+        '''
+        self.disk_size = self.stored_bytes()
+        if self.disk_size <= self.max_bytes:
+            return 0
+        target = self.max_bytes * DISK_EVICT_TO
+        evicted = []
+        rows = self.conn.execute('SELECT Key, length(Body) FROM Responses ORDER BY CreatedAt')
+        for key, size in rows:
+            if self.disk_size <= target:
+                break
+            evicted.append((key,))
+            self.disk_size -= size
+        rows.close()
+        with self.conn:
+            self.conn.executemany('DELETE FROM Responses WHERE Key = ?', evicted)
+        self.disk_evictions += len(evicted)
+        return len(evicted)
+
+    def remember(self, key, entry):
+        '''Keeps an entry in memory, evicting the least recently used
+        ones until the cache fits in max_bytes. Call with the lock held.
+
+        Parameters
+        ----------
+        key: string
+            The cache key.
+        entry: tuple
+            The ETag and the page.
+
+        Returns
+        -------
+        None
+        '''
+        if len(entry[1]) > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[1])
+        self.entries[key] = entry
+        self.size += len(entry[1])
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted[1])
+            self.evictions += 1
+
+    def clear(self, keep_version=None):
+        '''Drops every entry in memory. Entries on disk are dropped
+        unless they belong to keep_version, since other processes may
+        already have written pages of the new version there.
+
+        Parameters
+        ----------
+        keep_version: string
+            Version whose pages on disk stay, or None to drop every
+            entry on disk too.
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            if self.conn is not None:
+                with self.conn:
+                    if keep_version is None:
+                        self.conn.execute('DELETE FROM Responses')
+                    else:
+                        self.conn.execute('DELETE FROM Responses WHERE Version IS NOT ?',
+                            [keep_version])
+                self.disk_size = self.stored_bytes()
+
+    def stats(self):
+        '''Returns the cache counters.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            Hits, misses, evictions, entries and bytes in memory, and
+            evictions and bytes on disk.
+        '''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'disk_evictions': self.disk_evictions,
+                'disk_bytes': self.disk_size,
+            }
@@ -0,0 +1,448 @@
+'''Finds the breeds most like each breed, for the Similar table. Every
+dog is a feature vector of one-hot Size, Barkiness, BreedGroup and
+Country and of Rank, MinLifespan and MaxLifespan scaled to [0, 1].
+Distances are computed in blocks with NumPy, so memory doesn't grow
+with the square of the catalog. A refresh updates the stored
+neighbours of the breeds it touches instead of finding them all again.
+Needs numpy.
+'''
+import numpy as np
+
+CATEGORY_COLUMNS = ['Size', 'Barkiness', 'BreedGroupId', 'CountryId']
+NUMBER_COLUMNS = ['Rank', 'MinLifespan', 'MaxLifespan']
+# two one-hot vectors that differ in one category are 2 apart squared,
+# and the scaled numbers add at most len(NUMBER_COLUMNS)
+MISMATCH_DISTANCE = 2.0
+BLOCK_CELLS = 2 ** 21       # query rows times candidate rows per block
+
+# groupings that between them hold every breed differing from a breed
+# in at most one category: the same Size, Barkiness and BreedGroup, or
+# the same Country
+ONE_MISMATCH_GROUPS = [[0, 1, 2], [3]]
+OUTPUT_ROWS = 100000        # breeds turned into Similar rows at a time
+
+def number_column(rows, i):
+    '''Reads one number column of dog rows, with NaN where it's missing.
+
+    Parameters
+    ----------
+    rows: list
+        Dog rows, as taken by encode.
+    i: int
+        Position of the column in NUMBER_COLUMNS.
+
+    Returns
+    -------
+    numpy.ndarray
+        The numbers.
+    '''
+    first = 1 + len(CATEGORY_COLUMNS)
+    return np.fromiter(
+        (v if isinstance(v, (int, float)) else np.nan for v in (row[first + i] for row in rows)),
+        np.float64, len(rows))
+
+def number_scale(rows):
+    '''Works out how encode scales the numbers of a catalog. Keeping it
+    lets a refresh scale changed breeds the way the stored neighbours
+    were scaled.
+
+    Parameters
+    ----------
+    rows: list
+        Dog rows, as taken by encode.
+
+    Returns
+    -------
+    list
+        (low, high, fill) per number column: the smallest and largest
+        number, None without any, and the scaled value missing numbers
+        get, which is the column's average.
+    '''
+    scale = []
+    for i in range(len(NUMBER_COLUMNS)):
+        column = number_column(rows, i)
+        column = column[~np.isnan(column)]
+        if not len(column):
+            scale.append((None, None, 0.0))
+            continue
+        low, high = column.min(), column.max()
+        column = (column - low) / (high - low) if high > low else np.zeros_like(column)
+        scale.append((float(low), float(high), float(column.mean())))
+    return scale
+
+def within(rows, scale):
+    '''Tells whether the numbers of some dog rows are all inside the
+    ranges of a scale, so scaling them with it keeps them in [0, 1].
+
+    Parameters
+    ----------
+    rows: list
+        Dog rows, as taken by encode.
+    scale: list
+        A scale from number_scale.
+
+    Returns
+    -------
+    bool
+        True when every number is inside its column's range.
+    '''
+    first = 1 + len(CATEGORY_COLUMNS)
+    for row in rows:
+        for v, (low, high, _) in zip(row[first:], scale):
+            if isinstance(v, (int, float)) and (low is None or not low <= v <= high):
+                return False
+    return True
+
+def encode(rows, scale=None):
+    '''Turns dog rows into the parts of their feature vectors. The
+    one-hot part is kept as one category code per column, since the
+    squared distance between two one-hot vectors is just 2 per column
+    where the codes differ.
+
+    Parameters
+    ----------
+    rows: list
+        (Id, Size, Barkiness, BreedGroupId, CountryId, Rank,
+        MinLifespan, MaxLifespan) tuples.
+    scale: list
+        How to scale the numbers, from number_scale. Worked out from
+        the rows when None.
+
+    Returns
+    -------
+    tuple
+        Array of Ids, array of category codes with a column per
+        category and array of scaled numbers with a column per number.
+        Missing numbers get the column's average.
+    '''
+    if scale is None:
+        scale = number_scale(rows)
+    n = len(rows)
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    codes = np.empty((n, len(CATEGORY_COLUMNS)), dtype=np.int32)
+    for i in range(len(CATEGORY_COLUMNS)):
+        values = {}
+        codes[:, i] = np.fromiter((values.setdefault(row[i + 1], len(values)) for row in rows),
+            np.int32, n)
+    numbers = np.empty((n, len(NUMBER_COLUMNS)), dtype=np.float64)
+    for i, (low, high, fill) in enumerate(scale):
+        column = numbers[:, i]
+        column[:] = number_column(rows, i)
+        known = ~np.isnan(column)
+        column[known] = (column[known] - low) / (high - low) if low is not None and high > low else 0.0
+        column[~known] = fill
+    return ids, codes, numbers
+
+def nearest(ids, codes, numbers, queries, candidates, k):
+    '''Finds the k candidates closest to every query row, leaving out
+    the row itself. Ties are broken by Id. The distances are computed a
+    block of query rows and a column at a time, so memory stays under
+    BLOCK_CELLS distances.
+
+    Parameters
+    ----------
+    ids: numpy.ndarray
+        The Id of every row.
+    codes: numpy.ndarray
+        Category codes from encode.
+    numbers: numpy.ndarray
+        Scaled numbers from encode.
+    queries: numpy.ndarray
+        Rows to find neighbours for.
+    candidates: numpy.ndarray
+        Rows the neighbours are picked from.
+    k: int
+        Number of neighbours.
+
+    Returns
+    -------
+    tuple
+        Array of neighbour rows and array of squared distances, with a
+        line of k per query, closest first. Lines are padded with row
+        -1 at an infinite distance when there are too few candidates.
+    '''
+    found = np.full((len(queries), k), -1, dtype=np.int64)
+    distances = np.full((len(queries), k), np.inf)
+    kk = min(k, len(candidates))
+    block = max(1, BLOCK_CELLS // len(candidates))
+    # in Id order, so that among equal distances the first ones win
+    candidates = candidates[np.argsort(ids[candidates], kind='stable')]
+    candidate_codes = codes[candidates].T.copy()
+    candidate_numbers = numbers[candidates].T.copy()
+    for start in range(0, len(queries), block):
+        q = queries[start:start + block]
+        mismatches = np.zeros((len(q), len(candidates)), dtype=np.int8)
+        for i in range(codes.shape[1]):
+            mismatches += codes[q, i][:, None] != candidate_codes[i]
+        d = mismatches * MISMATCH_DISTANCE
+        diff = np.empty_like(d)
+        for i in range(numbers.shape[1]):
+            np.subtract(numbers[q, i][:, None], candidate_numbers[i], out=diff)
+            diff *= diff
+            d += diff
+        d[q[:, None] == candidates[None, :]] = np.inf
+        # keep everything closer than the k-th distance, and the first
+        # of the candidates tied at it
+        kth = np.partition(d, kk - 1, axis=1)[:, kk - 1:kk]
+        closer = d < kth
+        tied = d == kth
+        keep = closer | (tied & (np.cumsum(tied, axis=1) <= kk - closer.sum(axis=1, keepdims=True)))
+        best = np.nonzero(keep)[1].reshape(len(q), kk)
+        best_d = np.take_along_axis(d, best, axis=1)
+        order = np.lexsort((best, best_d), axis=1)
+        found[start:start + len(q), :kk] = candidates[np.take_along_axis(best, order, axis=1)]
+        distances[start:start + len(q), :kk] = np.take_along_axis(best_d, order, axis=1)
+    found[np.isinf(distances)] = -1
+    return found, distances
+
+def merge(ids, found, distances, more_found, more_distances):
+    '''Merges two lists of neighbours of the same rows into one, keeping
+    the k closest and dropping neighbours that are in both lists.
+
+    Parameters
+    ----------
+    ids: numpy.ndarray
+        The Id of every row.
+    found, distances: numpy.ndarray
+        Neighbours and squared distances, as returned by nearest.
+    more_found, more_distances: numpy.ndarray
+        More neighbours and squared distances of the same rows.
+
+    Returns
+    -------
+    tuple
+        The merged neighbours and squared distances.
+    '''
+    k = found.shape[1]
+    rows = np.concatenate([found, more_found], axis=1)
+    d = np.concatenate([distances, more_distances], axis=1)
+    by_row = np.sort(rows, axis=1)
+    d = np.take_along_axis(d, np.argsort(rows, axis=1, kind='stable'), axis=1)
+    duplicate = np.zeros(by_row.shape, dtype=bool)
+    duplicate[:, 1:] = (by_row[:, 1:] == by_row[:, :-1]) & (by_row[:, 1:] >= 0)
+    d[duplicate] = np.inf
+    order = np.lexsort((np.where(by_row >= 0, ids[by_row], np.iinfo(np.int64).max), d), axis=1)[:, :k]
+    merged = np.take_along_axis(by_row, order, axis=1)
+    merged_d = np.take_along_axis(d, order, axis=1)
+    merged[np.isinf(merged_d)] = -1
+    return merged, merged_d
+
+def pair_distances(codes, numbers, queries, found):
+    '''Computes the squared distances from query rows to given
+    neighbours, adding the parts up in the order nearest does, so the
+    same pair always gets the same distance.
+
+    Parameters
+    ----------
+    codes: numpy.ndarray
+        Category codes from encode.
+    numbers: numpy.ndarray
+        Scaled numbers from encode.
+    queries: numpy.ndarray
+        The query rows.
+    found: numpy.ndarray
+        A line of neighbour rows per query. Row -1 is no neighbour.
+
+    Returns
+    -------
+    numpy.ndarray
+        The squared distances, infinite for no neighbour.
+    '''
+    mismatches = np.zeros(found.shape, dtype=np.int8)
+    for i in range(codes.shape[1]):
+        mismatches += codes[queries, i][:, None] != codes[found, i]
+    d = mismatches * MISMATCH_DISTANCE
+    for i in range(numbers.shape[1]):
+        diff = numbers[queries, i][:, None] - numbers[found, i]
+        diff *= diff
+        d += diff
+    d[found < 0] = np.inf
+    return d
+
+def groups(codes, columns, queries=None):
+    '''Splits the rows into groups with the same codes in some columns.
+
+    Parameters
+    ----------
+    codes: numpy.ndarray
+        Category codes from encode.
+    columns: list
+        Positions of the category columns to group by.
+    queries: numpy.ndarray
+        Rows to find groups for. Every row when None.
+
+    Returns
+    -------
+    list
+        (query rows in the group, every row in the group) per group
+        holding any of the query rows.
+    '''
+    keys = np.unique(codes[:, columns], axis=0, return_inverse=True)[1].reshape(-1)
+    order = np.argsort(keys, kind='stable')
+    members = np.split(order, np.flatnonzero(np.diff(keys[order])) + 1)
+    if queries is None:
+        return [(group, group) for group in members]
+    if not len(queries):
+        return []
+    queries = queries[np.argsort(keys[queries], kind='stable')]
+    split = np.split(queries, np.flatnonzero(np.diff(keys[queries])) + 1)
+    return [(q, members[keys[q[0]]]) for q in split]
+
+def search(ids, codes, numbers, queries, k):
+    '''Finds the k nearest rows of some rows. They are first compared
+    with the rows in all the same categories, which are less than one
+    mismatch apart, and then with the rows that differ in at most one
+    category. A row is settled as soon as its k-th neighbour is closer
+    than any row it hasn't been compared with could be. The few rows
+    left at the end are compared with the whole catalog.
+
+    Parameters
+    ----------
+    ids: numpy.ndarray
+        The Id of every row.
+    codes: numpy.ndarray
+        Category codes from encode.
+    numbers: numpy.ndarray
+        Scaled numbers from encode.
+    queries: numpy.ndarray
+        Rows to find neighbours for.
+    k: int
+        Number of neighbours.
+
+    Returns
+    -------
+    tuple
+        Neighbours and squared distances, as returned by nearest.
+    '''
+    found = np.full((len(queries), k), -1, dtype=np.int64)
+    distances = np.full((len(queries), k), np.inf)
+    at = np.full(len(ids), -1, dtype=np.int64)   # where a row is among the queries
+    at[queries] = np.arange(len(queries))
+    for q, group in groups(codes, list(range(codes.shape[1])), queries):
+        if len(group) > k: # smaller groups can't settle anyone
+            found[at[q]], distances[at[q]] = nearest(ids, codes, numbers, q, group, k)
+    pending = distances[:, -1] >= MISMATCH_DISTANCE
+    for columns in ONE_MISMATCH_GROUPS:
+        for q, group in groups(codes, columns, queries):
+            q = q[pending[at[q]]]
+            if len(q) and len(group) > 1:
+                more = nearest(ids, codes, numbers, q, group, k)
+                found[at[q]], distances[at[q]] = merge(ids, found[at[q]], distances[at[q]], *more)
+    pending &= distances[:, -1] >= 2 * MISMATCH_DISTANCE
+    rest = np.flatnonzero(pending)
+    if len(rest):
+        found[rest], distances[rest] = nearest(ids, codes, numbers, queries[rest],
+            np.arange(len(ids)), k)
+    return found, distances
+
+def similar_rows(ids, rows, found, distances):
+    '''Turns neighbours into rows of the Similar table.
+
+    Parameters
+    ----------
+    ids: numpy.ndarray
+        The Id of every row.
+    rows: numpy.ndarray
+        The rows the neighbours belong to.
+    found, distances: numpy.ndarray
+        Neighbours and squared distances of those rows, as returned by
+        nearest.
+
+    Returns
+    -------
+    generator
+        (DogId, Position, SimilarId, Distance) tuples, with distances
+        rounded to 6 places.
+    '''
+    k = found.shape[1]
+    distances = np.sqrt(distances).round(6)
+    positions = list(range(k)) * OUTPUT_ROWS
+    for start in range(0, len(rows), OUTPUT_ROWS):
+        end = min(start + OUTPUT_ROWS, len(rows))
+        yield from zip(np.repeat(ids[rows[start:end]], k).tolist(), positions,
+            ids[found[start:end]].ravel().tolist(), distances[start:end].ravel().tolist())
+
+def nearest_breeds(rows, k, scale=None):
+    '''Finds the k nearest breeds of every breed.
+
+    Parameters
+    ----------
+    rows: list
+        (Id, Size, Barkiness, BreedGroupId, CountryId, Rank,
+        MinLifespan, MaxLifespan) tuples.
+    k: int
+        Number of neighbours per breed.
+    scale: list
+        How to scale the numbers, from number_scale. Worked out from
+        the rows when None.
+
+    Returns
+    -------
+    generator
+        (DogId, Position, SimilarId, Distance) tuples.
+    '''
+    k = min(k, len(rows) - 1)
+    if k < 1:
+        return
+    ids, codes, numbers = encode(rows, scale)
+    everyone = np.arange(len(ids))
+    yield from similar_rows(ids, everyone, *search(ids, codes, numbers, everyone, k))
+
+def update_nearest_breeds(rows, k, scale, changed, stale, kth, load):
+    '''Finds the neighbours that differ from the stored ones after some
+    breeds changed, with work in proportion to the changed breeds
+    rather than to the square of the catalog. Changed breeds, and the
+    breeds whose stored neighbours include a changed or removed breed,
+    get their neighbours searched for again. Every other breed keeps
+    its stored neighbours, and a changed breed only joins them when
+    it's closer than the stored k-th neighbour.
+
+    Parameters
+    ----------
+    rows: list
+        (Id, Size, Barkiness, BreedGroupId, CountryId, Rank,
+        MinLifespan, MaxLifespan) tuples of the whole catalog, by Id.
+    k: int
+        Number of neighbours per breed, the same as stored.
+    scale: list
+        The scale the stored neighbours were found with.
+    changed: list
+        Ids of the new and changed breeds.
+    stale: list
+        Ids of the breeds whose stored neighbours include a changed or
+        removed breed.
+    kth: list
+        (DogId, Distance) of the stored k-th neighbour of every breed.
+    load: callable
+        Takes a sorted list of Ids and returns the Ids of their stored
+        neighbours, k per breed in the same order.
+
+    Returns
+    -------
+    generator
+        (DogId, Position, SimilarId, Distance) tuples of every breed
+        whose neighbours are written again.
+    '''
+    ids, codes, numbers = encode(rows, scale)
+    redo = np.searchsorted(ids, np.array(sorted(set(changed) | set(stale)), dtype=np.int64))
+    if len(redo):
+        yield from similar_rows(ids, redo, *search(ids, codes, numbers, redo, k))
+    new = np.searchsorted(ids, np.array(sorted(changed), dtype=np.int64))
+    rest = np.setdiff1d(np.arange(len(ids)), redo)
+    if not len(new) or not len(rest):
+        return
+    # stored distances are rounded to 6 places, so they get a little room
+    bound = np.full(len(ids), np.inf)
+    if kth:
+        kth_ids, kth_distances = (np.array(column) for column in zip(*kth))
+        at = np.minimum(np.searchsorted(ids, kth_ids), len(ids) - 1)
+        known = ids[at] == kth_ids
+        bound[at[known]] = (kth_distances[known] + 1e-6) ** 2
+    closest = nearest(ids, codes, numbers, rest, new, 1)[1][:, 0]
+    rest = rest[closest <= bound[rest]]
+    if not len(rest):
+        return
+    found = np.searchsorted(ids, np.array(load(ids[rest].tolist()), dtype=np.int64)).reshape(len(rest), k)
+    more = nearest(ids, codes, numbers, rest, new, k)
+    yield from similar_rows(ids, rest, *merge(ids, found,
+        pair_distances(codes, numbers, rest, found), *more))
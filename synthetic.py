@@ -0,0 +1,157 @@
+'''Makes synthetic dog catalogs that look like the scraped one, for
+checking query plans and timing the app on catalogs far bigger than
+the real one. It can also make the breed pages themselves, laid out
+like the Animal Planet ones, for timing the scraper without a network.
+'''
+import html
+import random
+
+import app
+
+SIZES = ['Small', 'Medium', 'Large']
+BARKINESS = ['Low', 'Medium', 'High']
+GROUPS = ['Herding', 'Hound', 'Non-Sporting', 'Sporting', 'Terrier', 'Toy', 'Working']
+COUNTRIES = ['Australia', 'Belgium', 'China', 'England', 'France', 'Germany',
+    'Hungary', 'Ireland', 'Italy', 'Japan', 'Mexico', 'Russia', 'Scotland',
+    'Spain', 'Switzerland', 'Tibet', 'United States', 'Wales']
+PASTIMES = ['Hunting', 'Herding', 'Guarding', 'Companion', 'Ratting', 'Sled pulling']
+
+# navigation and scripts around the blocks the scraper reads, so pages
+# are about as big as the real ones
+PAGE_LINKS = 150
+PAGE_SCRIPT_BYTES = 20000
+
+def make_dogs(n_dogs, seed=507):
+    '''Makes records in the same format as get_breed_records.
+
+    Parameters
+    ----------
+    n_dogs: int
+        Number of dogs to make.
+    seed: int
+        Seed for the random generator, so catalogs can be rebuilt.
+
+    Returns
+    -------
+    list
+        Records from each dog in list format.
+    '''
+    rng = random.Random(seed)
+    # a long tail of made up countries so the catalog isn't only
+    # low cardinality columns
+    countries = COUNTRIES + [f'Country {i}' for i in range(max(0, n_dogs // 1000))]
+    dogs = []
+    for i in range(n_dogs):
+        rank = 'n/a' if rng.random() < 0.05 else str(rng.randint(1, max(n_dogs, 200)))
+        min_life = rng.randint(6, 13)
+        dogs.append([
+            f'Synthetic Breed {i}',
+            rank,
+            f'{rng.choice(PASTIMES)} {rng.choice(PASTIMES).lower()}',
+            rng.choice(countries),
+            rng.choice(GROUPS),
+            rng.choice(SIZES),
+            rng.choice(BARKINESS),
+            str(min_life),
+            str(min_life + rng.randint(1, 5)),
+            f'http://www.animalplanet.com/breed-selector/dog-breeds/synthetic-breed-{i}.html',
+        ])
+    return dogs
+
+def build_catalog(db_name, n_dogs, seed=507):
+    '''Builds a synthetic dog database at db_name and points the app
+    at it.
+
+    Parameters
+    ----------
+    db_name: string
+        Path of the database to build.
+    n_dogs: int
+        Number of dogs in the catalog.
+    seed: int
+        Seed for the random generator.
+
+    Returns
+    -------
+    list
+        The records that were loaded.
+    '''
+    dogs = make_dogs(n_dogs, seed)
+    app.use_database(db_name)
+    app.create_db()
+    app.load_catalog(dogs)
+    return dogs
+
+def page_padding():
+    '''Makes the navigation and script markup every synthetic page
+    is wrapped in.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    tuple
+        The markup before and after the content of a page.
+    '''
+    links = ''.join(f'<li><a href="/shows/show-{i}.html">Show {i}</a></li>' for i in range(PAGE_LINKS))
+    script = 'var dogs = 0;' * (PAGE_SCRIPT_BYTES // 13)
+    header = (f'<html><head><title>Animal Planet</title><script>{script}</script></head>'
+        f'<body><nav class="header"><ul>{links}</ul></nav>')
+    footer = f'<footer class="footer"><ul>{links}</ul></footer></body></html>'
+    return header, footer
+
+def breed_page(dog, padding):
+    '''Makes the page of a breed from one of its records.
+
+    Parameters
+    ----------
+    dog: list
+        A record in the format of make_dogs.
+    padding: tuple
+        Markup from page_padding.
+
+    Returns
+    -------
+    string
+        The breed page.
+    '''
+    name, rank, pastime, country, group, size, bark, min_life, max_life = map(html.escape, dog[:9])
+    return (f'{padding[0]}<h1>{name}</h1>'
+        '<div class="stats clear"><div class="left">AKC Rank</div>'
+        f'<div class="right">{rank}</div><div class="right">{size}</div></div>'
+        '<div class="body divider"><h3>FAST FACTS:</h3>\n'
+        f'<p>Original Pastime: {pastime}</p>\n'
+        f'<p>Origin: {country}</p>\n'
+        f'<p>Breed Group: {group}</p>\n'
+        f'<p>Life Span: {min_life}-{max_life} years</p>\n'
+        f'<p>Size: {size}</p>\n'
+        f'<p>Barkiness: {bark}</p>\n'
+        f'</div>{padding[1]}')
+
+def make_site(n_dogs, seed=507, url=app.DOG):
+    '''Makes the A-Z breed list and every breed page of a synthetic
+    catalog.
+
+    Parameters
+    ----------
+    n_dogs: int
+        Number of breeds on the site.
+    seed: int
+        Seed for the random generator.
+    url: string
+        URL of the A-Z breed list.
+
+    Returns
+    -------
+    dict
+        URL as the key and the page as the value.
+    '''
+    padding = page_padding()
+    dogs = make_dogs(n_dogs, seed)
+    items = ''.join(f'<li><a href="{html.escape(dog[9])}">{html.escape(dog[0])}</a></li>' for dog in dogs)
+    pages = {url: f'{padding[0]}<section id="tabAtoZ"><ul>{items}</ul></section>{padding[1]}'}
+    for dog in dogs:
+        pages[dog[9]] = breed_page(dog, padding)
+    return pages